@@ -1,21 +1,45 @@
-import subprocess
 import os
 import shlex
 import discord
+import aiohttp
 from discord.ext import commands
 import asyncio
 from dotenv import load_dotenv
 import shutil
 import tempfile
+import glob
+import socket
 import io
+import html
+import importlib.util
+import multiprocessing
+import concurrent.futures
+import time
+import hashlib
+import codecs
+import functools
+import itertools
+import sqlite3
+import threading
+from html.parser import HTMLParser
+import contextlib
+import random
+from datetime import timedelta
+import urllib.parse
 import re # Import regex for filename sanitization
+import json
+import sys
+import argparse
+from collections import deque
 
 # Import rich for enhanced display
 from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.progress import Progress, ProgressColumn, SpinnerColumn, TextColumn, BarColumn, MofNCompleteColumn
 from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
 from rich.text import Text
+from rich.table import Table
+from rich.markup import escape
 from rich.rule import Rule
 from rich.tree import Tree
 from rich.style import Style
@@ -33,6 +57,153 @@ load_dotenv()
 # Constants for retry logic when sending to Discord
 MAX_RETRIES = 5
 INITIAL_DELAY = 1  # seconds
+MAX_DELAY = 60  # seconds
+
+def _env_float(name, default=None):
+    """
+    Reads an optional float from the environment, falling back to `default` when unset or invalid.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        console.print(f"[yellow]Warning: Invalid {name} '{value}'. Using default.[/yellow]")
+        return default
+
+def _env_int(name, default):
+    """
+    Reads an optional integer from the environment, falling back to `default` when unset or invalid.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        console.print(f"[yellow]Warning: Invalid {name} '{value}'. Using default.[/yellow]")
+        return default
+
+# Maximum number of channels/threads exported and rendered at the same time.
+ARCHIVE_CONCURRENCY = max(1, _env_int('ARCHIVE_CONCURRENCY', 3))
+
+# Worker counts for the export -> render -> upload pipeline and the size of the queues between
+# stages. A small queue keeps only a few exported HTML files (and their media) on disk at once.
+EXPORT_WORKERS = max(1, _env_int('EXPORT_WORKERS', ARCHIVE_CONCURRENCY))
+RENDER_WORKERS = max(1, _env_int('RENDER_WORKERS', ARCHIVE_CONCURRENCY))
+UPLOAD_WORKERS = max(1, _env_int('UPLOAD_WORKERS', 2))
+PIPELINE_QUEUE_SIZE = max(1, _env_int('PIPELINE_QUEUE_SIZE', 2))
+
+# How HTML is converted to PDF: "pool" keeps warm WeasyPrint worker processes, "cli" runs the
+# weasyprint command for every file, "auto" uses the pool when the weasyprint library is importable.
+RENDER_BACKEND = (os.getenv('RENDER_BACKEND') or "auto").lower()
+# Recycle a render worker after this many PDFs to release memory WeasyPrint holds on to.
+RENDER_TASKS_PER_WORKER = max(1, _env_int('RENDER_TASKS_PER_WORKER', 50))
+
+# Incremental archiving: "off" exports full history every run, "delta" exports only messages newer
+# than the last archive of each channel, "merged" does the same and appends them to the previous PDF.
+INCREMENTAL_MODE = (os.getenv('INCREMENTAL_MODE') or "off").lower()
+ARCHIVE_STATE_FILE = ".archive_state.json"
+# Journal of the current run's per-chat progress, used by the resume command.
+# One journal per run, named after the run's start time and process ID.
+ARCHIVE_JOURNAL_FILE = ".archive_journal.{run_id}.json"
+ARCHIVE_JOURNAL_PATTERN = ".archive_journal*.json"
+# Durable work queue for distributed archiving (the `queue` and `worker` commands). Workers lease a
+# chat for QUEUE_LEASE_SECONDS and renew the lease while they work; a crashed worker's lease expires
+# and the chat is handed to another worker, up to QUEUE_MAX_ATTEMPTS times.
+ARCHIVE_QUEUE_FILE = ".archive_queue.sqlite"
+QUEUE_LEASE_SECONDS = max(30, _env_int('QUEUE_LEASE_SECONDS', 600))
+QUEUE_MAX_ATTEMPTS = max(1, _env_int('QUEUE_MAX_ATTEMPTS', 3))
+QUEUE_POLL_SECONDS = 10
+# Per-chat timings of earlier runs, used to estimate job sizes for scheduling and the ETA.
+ARCHIVE_ESTIMATES_FILE = ".archive_estimates.json"
+# Order in which the pipeline starts chats: "largest" (estimated largest first, which keeps one big
+# thread from starting last and setting the total runtime) or "discovery" (the order they were found).
+SCHEDULE_ORDER = (os.getenv('SCHEDULE_ORDER') or "largest").lower()
+
+# Shared media cache: when MEDIA_CACHE_DIR is set, every export downloads media into that directory
+# and DiscordChatExporter reuses files that are already there. Least recently used files are
+# evicted once the cache grows past MEDIA_CACHE_MAX_MB.
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR') or None
+MEDIA_CACHE_MAX_BYTES = max(0, _env_int('MEDIA_CACHE_MAX_MB', 2048)) * 1024 * 1024
+
+# Which exporter produces the HTML: "dce" runs DiscordChatExporter.Cli, "native" streams the
+# history through the bot's own discord.py session.
+EXPORTER = (os.getenv('EXPORTER') or "dce").lower()
+# Maximum number of attachment/avatar downloads in flight per native export.
+NATIVE_MEDIA_CONCURRENCY = max(1, _env_int('NATIVE_MEDIA_CONCURRENCY', 8))
+
+# Partitioned archiving for very large channels: split the history into windows of PARTITION_DAYS
+# days, export and render up to PARTITION_WORKERS windows in parallel, then either merge them into one
+# PDF (PARTITION_OUTPUT=merged, needs pypdf) or keep a numbered set of PDFs (PARTITION_OUTPUT=numbered).
+PARTITION_DAYS = _env_float('PARTITION_DAYS', 0)
+PARTITION_WORKERS = max(1, _env_int('PARTITION_WORKERS', EXPORT_WORKERS))
+PARTITION_OUTPUT = (os.getenv('PARTITION_OUTPUT') or "merged").lower()
+# Each partition runs its own exporter process, so very long histories get wider windows instead.
+PARTITION_MAX_WINDOWS = max(1, _env_int('PARTITION_MAX_WINDOWS', 64))
+
+# Startup: "full" fetches every guild's member list at login (discord.py's default). "lazy" skips
+# that and caches no members until a flow needs them (user search, DMing channel members), then
+# fetches only the guilds involved, so one-off archives are ready in seconds on large bots.
+STARTUP_MODE = (os.getenv('STARTUP_MODE') or "full").lower()
+
+# Searchable archive index: when ARCHIVE_INDEX_FILE is set, every export's messages are also
+# written to this SQLite database with an FTS5 full-text index (see the `search` command).
+ARCHIVE_INDEX_FILE = os.getenv('ARCHIVE_INDEX_FILE') or None
+# Rows inserted per executemany call; a whole export is ingested in one transaction.
+ARCHIVE_INDEX_BATCH_SIZE = 5000
+
+# Optional pre-render pass: when MEDIA_DOWNSCALE_DPI is set, images in an export's _attachments
+# directory wider than the page can show at that DPI are downscaled, and JPEG/WebP images are
+# recompressed at MEDIA_DOWNSCALE_QUALITY, on MEDIA_DOWNSCALE_WORKERS processes. Needs Pillow
+# (installed with WeasyPrint). Files in the shared media cache are never modified.
+MEDIA_DOWNSCALE_DPI = _env_float('MEDIA_DOWNSCALE_DPI', 0)
+MEDIA_DOWNSCALE_QUALITY = min(95, max(1, _env_int('MEDIA_DOWNSCALE_QUALITY', 80)))
+MEDIA_DOWNSCALE_WORKERS = max(1, _env_int('MEDIA_DOWNSCALE_WORKERS', os.cpu_count() or 1))
+# Width of the rendered page in inches: A4, WeasyPrint's default, with PAGE_STYLESHEET's zero margins.
+PAGE_WIDTH_INCHES = 8.27
+
+# Limits for the shared Discord send scheduler: total sends in flight, and sends in flight per
+# destination (channel or member). One per destination keeps messages in order.
+SEND_CONCURRENCY = max(1, _env_int('SEND_CONCURRENCY', 8))
+SEND_PER_DESTINATION = max(1, _env_int('SEND_PER_DESTINATION', 1))
+
+# How archived PDFs are DMed to several members: "link" uploads each PDF once (or reuses the copy
+# already posted to the archive channel) and sends the other members links to it; "attach" uploads
+# the files to every member.
+DM_FANOUT_MODE = (os.getenv('DM_FANOUT_MODE') or "attach").lower()
+# Discord's per-message limits.
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+MAX_MESSAGE_LENGTH = 2000
+# Upload size limit used for DMs and when a guild's limit is unknown. UPLOAD_SIZE_LIMIT_MB overrides
+# the guild limit. Only this fraction of the limit is packed into a message, leaving room for overhead.
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+UPLOAD_SIZE_LIMIT = _env_float('UPLOAD_SIZE_LIMIT_MB')
+UPLOAD_SIZE_MARGIN = 0.95
+
+# Archived thread discovery: parent channels listed at the same time, and how long (seconds)
+# discovered threads are cached per guild.
+THREAD_DISCOVERY_CONCURRENCY = max(1, _env_int('THREAD_DISCOVERY_CONCURRENCY', 8))
+THREAD_CACHE_TTL = _env_float('THREAD_CACHE_TTL', 300)
+
+PAGE_STYLESHEET = "@page { margin: 0; }"
+
+# Instrumentation reports: a JSON file with every stage record and totals, and a Prometheus
+# textfile (for node_exporter's textfile collector). Both are disabled when unset.
+METRICS_FILE = os.getenv('METRICS_FILE') or None
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE') or None
+
+# Output of DiscordChatExporter and WeasyPrint is written to one log file per job and stage in
+# this directory (default: ".logs" in the save directory) instead of being printed.
+COMMAND_LOG_DIR = os.getenv('COMMAND_LOG_DIR') or None
+COMMAND_LOG_TAIL_LINES = _env_int('COMMAND_LOG_TAIL_LINES', 40)
+MAX_LOG_LINE_LENGTH = 8192
+PROGRESS_PATTERN = re.compile(r'(\d{1,3}(?:\.\d+)?)\s?%')
+
+# Timeouts (in seconds) for the external export and render commands. Unset means no timeout.
+EXPORT_TIMEOUT = _env_float('EXPORT_TIMEOUT')
+RENDER_TIMEOUT = _env_float('RENDER_TIMEOUT')
 
 # --- Utility Function for Filename Sanitization ---
 def sanitize_filename(name):
@@ -54,138 +225,2388 @@ intents.guilds = True
 intents.message_content = True
 intents.members = True # Required to access guild members for DM functionality
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+if STARTUP_MODE == "lazy":
+    # Only the native exporter reads message content through the bot's session.
+    intents.message_content = EXPORTER == "native"
+    bot = commands.Bot(command_prefix='!', intents=intents, chunk_guilds_at_startup=False,
+                       member_cache_flags=discord.MemberCacheFlags.none())
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
+
+# --- Instrumentation ---
+def read_peak_rss(pid):
+    """
+    Returns the peak resident set size (bytes) of a running process from /proc, or None.
+    """
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def children_peak_rss():
+    """
+    Returns the largest peak RSS (bytes) of any finished child process, where the platform reports it.
+    """
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    except (ImportError, OSError):
+        return None
+
+def path_size(path):
+    """
+    Returns the size in bytes of a file, or of every file under a directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def count_exported_messages(html_file):
+    """
+    Counts the messages in a DiscordChatExporter (or native) HTML export.
+    """
+    count = 0
+    with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            count += line.count(' data-message-id="')
+    return count
+
+class Metrics:
+    """
+    Collects one record per stage run (export, render, send, archive) with wall time, bytes,
+    message counts, child peak RSS and retries, and writes them as a JSON report and a
+    Prometheus textfile.
+    """
+
+    PREFIX = "discord_archiver"
+    SUMMED_FIELDS = ("bytes", "messages", "retries")
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, stage, **fields):
+        """
+        Times the enclosed block. The yielded dict can be filled with extra fields; set
+        `ok` to False to record a failure without raising.
+        """
+        record = {"stage": stage, "ok": True, **fields}
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record["ok"] = False
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            record["finished_at"] = time.time()
+            self.records.append(record)
+
+    def add(self, stage, seconds, ok=True, **fields):
+        """
+        Records a stage that was timed elsewhere, e.g. across event handlers.
+        """
+        self.records.append({"stage": stage, "ok": ok, **fields, "seconds": round(seconds, 4), "finished_at": time.time()})
+
+    def totals(self):
+        totals = {}
+        for record in self.records:
+            stage_totals = totals.setdefault(record["stage"], {"runs": 0, "failures": 0, "seconds": 0.0, "peak_rss_bytes": 0,
+                                                               **{field: 0 for field in self.SUMMED_FIELDS}})
+            stage_totals["runs"] += 1
+            stage_totals["failures"] += 0 if record["ok"] else 1
+            stage_totals["seconds"] += record["seconds"]
+            for field in self.SUMMED_FIELDS:
+                stage_totals[field] += record.get(field) or 0
+            stage_totals["peak_rss_bytes"] = max(stage_totals["peak_rss_bytes"], record.get("peak_rss_bytes") or 0)
+        return totals
+
+    def prometheus_text(self):
+        totals = self.totals()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} {kind}")
+            for stage, value in samples:
+                lines.append(f'{self.PREFIX}_{name}{{stage="{stage}"}} {value}')
 
-def run_command(command, description):
+        metric("stage_runs_total", "counter", "Number of times each stage ran.", [(k, v["runs"]) for k, v in totals.items()])
+        metric("stage_failures_total", "counter", "Number of failed stage runs.", [(k, v["failures"]) for k, v in totals.items()])
+        metric("stage_seconds_total", "counter", "Wall time spent in each stage.", [(k, round(v["seconds"], 4)) for k, v in totals.items()])
+        metric("stage_bytes_total", "counter", "Bytes produced or sent by each stage.", [(k, v["bytes"]) for k, v in totals.items()])
+        metric("stage_messages_total", "counter", "Discord messages exported.", [(k, v["messages"]) for k, v in totals.items()])
+        metric("stage_retries_total", "counter", "Retried Discord requests.", [(k, v["retries"]) for k, v in totals.items()])
+        metric("stage_peak_rss_bytes", "gauge", "Largest child process peak RSS seen in each stage.", [(k, v["peak_rss_bytes"]) for k, v in totals.items()])
+        lines.append(f"# HELP {self.PREFIX}_last_report_timestamp_seconds When this report was written.")
+        lines.append(f"# TYPE {self.PREFIX}_last_report_timestamp_seconds gauge")
+        lines.append(f"{self.PREFIX}_last_report_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_atomic(path, text):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def write_reports(self):
+        """
+        Writes METRICS_FILE and METRICS_PROM_FILE, when configured.
+        """
+        try:
+            if METRICS_FILE:
+                report = {"started_at": self.started_at, "written_at": time.time(), "totals": self.totals(), "records": self.records}
+                self._write_atomic(METRICS_FILE, json.dumps(report, indent=2, default=str))
+            if METRICS_PROM_FILE:
+                self._write_atomic(METRICS_PROM_FILE, self.prometheus_text())
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not write metrics: {e}[/yellow]")
+
+metrics = Metrics()
+
+async def run_command(command, description, timeout=None, stats=None, log_file=None, on_progress=None):
     """
-    Executes a shell command and prints its output using rich.
-    Handles potential errors during command execution.
+    Executes a command as an asyncio subprocess, streaming its output line by line.
+    The event loop (and with it the Discord gateway heartbeat) keeps running while
+    the child process works. The child is killed if it exceeds `timeout` seconds
+    or if the awaiting task is cancelled. If `stats` is a dict, the child's peak RSS is
+    stored in it as "peak_rss_bytes".
+
+    Output is written to `log_file` as it arrives (or printed dimmed when no log file is
+    given); only the last COMMAND_LOG_TAIL_LINES lines are kept in memory, to show on failure.
+    `on_progress`, if given, is called with a 0-1 fraction whenever the output reports a
+    new whole percentage (DiscordChatExporter prints one per channel as it exports).
     """
     console.print(Rule(f"[bold cyan]{description}[/bold cyan]"))
-    console.print(f"[grey]Executing: {' '.join(shlex.quote(arg) for arg in command)}[/grey]")
+    # Keep the Discord token out of the console (batch mode's stderr often ends up in cron mail) and log files.
+    printable = ' '.join("***" if previous in ("-t", "--token") else shlex.quote(arg)
+                         for previous, arg in zip([None, *command], command))
+    console.print(f"[grey]Executing: {printable}[/grey]")
+    process = None
+    sampler = None
+    log = None
+    tail = deque(maxlen=COMMAND_LOG_TAIL_LINES)
+    last_percent = [None]
+
+    def handle_line(line, stream_name):
+        if not line.strip():
+            return
+        if stream_name == "stderr":
+            line = f"[stderr] {line}"
+        tail.append(line)
+        if log:
+            log.write(line + "\n")
+        else:
+            console.print(Text(line, style="grey50"))
+        if on_progress:
+            match = PROGRESS_PATTERN.search(line)
+            if match:
+                percent = min(100, int(float(match.group(1))))
+                if percent != last_percent[0]:
+                    last_percent[0] = percent
+                    on_progress(percent / 100)
+
+    async def pump(stream, stream_name):
+        # Read fixed-size chunks rather than lines so one enormous line cannot exhaust memory;
+        # carriage returns count as line breaks since progress bars redraw in place.
+        # An incremental decoder keeps multi-byte characters that straddle two chunks intact.
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ""
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                pending += decoder.decode(b"", final=True)
+                break
+            pending += decoder.decode(chunk)
+            *lines, pending = re.split(r'\r\n|\r|\n', pending)
+            for line in lines:
+                handle_line(line[:MAX_LOG_LINE_LENGTH], stream_name)
+            if len(pending) > MAX_LOG_LINE_LENGTH:
+                handle_line(pending[:MAX_LOG_LINE_LENGTH], stream_name)
+                pending = ""
+        handle_line(pending[:MAX_LOG_LINE_LENGTH], stream_name)
+
+    def print_tail(style):
+        if tail:
+            title = f"Last {len(tail)} line(s)" + (f" — full log: {log_file}" if log_file else "")
+            console.print(Panel("\n".join(tail), title=f"[{style} bold]{title}[/{style} bold]", border_style=style))
+
+    started = time.perf_counter()
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        console.print(Panel(result.stdout, title="[green bold]STDOUT[/green bold]", border_style="green"))
-        if result.stderr:
-            console.print(Panel(result.stderr, title="[yellow bold]STDERR[/yellow bold]", border_style="yellow"))
+        if log_file:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            log = open(log_file, 'w', encoding='utf-8')
+            log.write(f"$ {printable}\n")
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        if stats is not None:
+            sampler = asyncio.create_task(_sample_peak_rss(process, stats))
+        await asyncio.wait_for(
+            asyncio.gather(pump(process.stdout, "stdout"), pump(process.stderr, "stderr"), process.wait()),
+            timeout=timeout,
+        )
+        if process.returncode != 0:
+            console.print(f"[bold red]Error:[/] Command '[cyan]{command[0]}[/cyan]' failed with exit code [bold]{process.returncode}[/bold]", style="red")
+            print_tail("red")
+            return False
+        console.print(f"[green]{description} finished in {time.perf_counter() - started:.1f}s.[/green]"
+                      + (f" [grey](log: {log_file})[/grey]" if log_file else ""))
         return True
     except FileNotFoundError:
         console.print(f"[bold red]Error:[/] Command '[cyan]{command[0]}[/cyan]' not found.", style="red")
         return False
-    except subprocess.CalledProcessError as e:
-        console.print(f"[bold red]Error:[/] Command '[cyan]{command[0]}[/cyan]' failed with exit code [bold]{e.returncode}[/bold]", style="red")
-        console.print(Panel(e.stdout, title="[red bold]STDOUT (Error)[/red bold]", border_style="red"))
-        console.print(Panel(e.stderr, title="[red bold]STDERR (Error)[/red bold]", border_style="red"))
+    except asyncio.TimeoutError:
+        await _kill_process(process)
+        console.print(f"[bold red]Error:[/] Command '[cyan]{command[0]}[/cyan]' timed out after [bold]{timeout}[/bold] seconds.", style="red")
+        print_tail("red")
         return False
+    except asyncio.CancelledError:
+        await _kill_process(process)
+        console.print(f"[yellow]Command '[cyan]{command[0]}[/cyan]' was cancelled.[/yellow]")
+        raise
     except Exception as e:
+        await _kill_process(process)
         console.print(f"[bold red]An unexpected error occurred while executing the command:[/bold red] {e}", style="red")
         return False
+    finally:
+        if sampler:
+            sampler.cancel()
+        if log:
+            log.close()
+
+def command_log_path(job, stage):
+    """
+    Returns the log file for one stage ("export" or "render") of an export job. The chat ID keeps
+    same-named threads and channels of different servers from sharing a log.
+    """
+    log_dir = COMMAND_LOG_DIR or os.path.join(job["save_directory"], ".logs")
+    suffix = f".part{job['part']:03d}" if job.get("part") else ""
+    return os.path.join(log_dir, f"{sanitize_filename(job['name'])}_{job['chat'].id}{suffix}.{stage}.log")
+
+async def _sample_peak_rss(process, stats, interval=0.5):
+    """
+    Records a running child's peak RSS (VmHWM) into `stats` until it exits.
+    Falls back to the largest finished child's peak where /proc is unavailable.
+    """
+    try:
+        while process.returncode is None:
+            peak = read_peak_rss(process.pid)
+            if peak:
+                stats["peak_rss_bytes"] = max(stats.get("peak_rss_bytes", 0), peak)
+            await asyncio.sleep(interval)
+    finally:
+        if "peak_rss_bytes" not in stats:
+            stats["peak_rss_bytes"] = children_peak_rss()
+
+async def _kill_process(process):
+    """
+    Kills a child process started by run_command (if still running) and reaps it.
+    """
+    if process is None or process.returncode is not None:
+        return
+    try:
+        process.kill()
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        console.print(f"[yellow]Warning: child process {process.pid} did not exit after being killed.[/yellow]")
+
+def is_thread_parent(channel):
+    """
+    Returns True for channels whose threads are archived with them: text channels and forums.
+    """
+    forum_type = getattr(discord, 'ForumChannel', None)
+    return isinstance(channel, discord.TextChannel) or (forum_type is not None and isinstance(channel, forum_type))
+
+def chat_display_name(chat):
+    """
+    Returns a human readable name for a channel, thread or DM.
+    """
+    return f"#{chat.name}" if not isinstance(chat, discord.DMChannel) else f"DM with {chat.recipient.name}"
+
+def as_pdf_list(result):
+    """
+    Normalises an archive result (None, one PDF path or a list of partition PDFs) to a list of paths.
+    """
+    if not result:
+        return []
+    return list(result) if isinstance(result, (list, tuple)) else [result]
+
+def export_file_paths(chat, save_directory, suffix=""):
+    """
+    Returns the (html_file, pdf_file) paths used when archiving `chat` into `save_directory`.
+    """
+    sanitized_chat_name = sanitize_filename(chat_display_name(chat))
+    output_filename_base = f"discord_export_{sanitized_chat_name}_{chat.id}{suffix}"
+    html_file = os.path.join(save_directory, f"{output_filename_base}.html")
+    pdf_file = os.path.join(save_directory, f"{output_filename_base}.pdf")
+    return html_file, pdf_file
+
+def media_directory_for(html_file):
+    """
+    Returns the directory DiscordChatExporter downloads media into for `html_file`.
+    """
+    return os.path.join(os.path.dirname(html_file), f"{os.path.splitext(os.path.basename(html_file))[0]}_attachments")
+
+# --- Incremental Archive State ---
+def load_archive_state(save_directory):
+    """
+    Loads the per-channel high-water marks recorded in `save_directory`.
+    """
+    state_path = os.path.join(save_directory, ARCHIVE_STATE_FILE)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        console.print(f"[yellow]Warning: Could not read archive state {state_path}: {e}. Starting fresh.[/yellow]")
+        return {}
+
+# Guards the read-modify-write of ARCHIVE_STATE_FILE across processes: queue workers sharing a save
+# directory replace it with their work queue's write transaction. Threads of one process take
+# _archive_state_thread_lock first.
+archive_state_lock = contextlib.nullcontext
+_archive_state_thread_lock = threading.Lock()
+
+def update_archive_state(save_directory, chat_id, entry):
+    """
+    Merges `entry` into the recorded state of one channel. Blocks while another process holds the
+    state lock, so it is run in an executor thread.
+    """
+    with _archive_state_thread_lock, archive_state_lock():
+        state = load_archive_state(save_directory)
+        state.setdefault(str(chat_id), {}).update(entry)
+        save_archive_state(save_directory, state)
+
+def save_archive_state(save_directory, state):
+    """
+    Atomically writes the per-channel high-water marks to `save_directory`.
+    """
+    state_path = os.path.join(save_directory, ARCHIVE_STATE_FILE)
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, state_path)
+
+async def fetch_latest_message_id(chat):
+    """
+    Returns the ID of the newest message in `chat`, or None if it has no messages.
+    """
+    try:
+        async for message in chat.history(limit=1):
+            return message.id
+    except discord.HTTPException as e:
+        console.print(f"[yellow]Warning: Could not fetch the latest message of {chat_display_name(chat)}: {e}[/yellow]")
+    return getattr(chat, 'last_message_id', None)
+
+async def prepare_export_job(chat, save_directory):
+    """
+    Describes what to export for `chat`: output paths and, in incremental mode, the message ID range.
+    The returned dict is passed through the export, render and finish steps.
+    """
+    html_file, pdf_file = export_file_paths(chat, save_directory)
+    job = {
+        "chat": chat, "name": chat_display_name(chat), "save_directory": save_directory,
+        "html_file": html_file, "pdf_file": pdf_file,
+        "after": None, "before": None, "high_water": None, "previous_pdf": None, "up_to_date": False,
+    }
+    if INCREMENTAL_MODE not in ("delta", "merged"):
+        return job
+
+    previous = load_archive_state(save_directory).get(str(chat.id), {})
+    high_water = await fetch_latest_message_id(chat)
+    job["high_water"] = high_water
+    job["previous_pdf"] = previous.get("pdf") if previous.get("pdf") and os.path.exists(previous["pdf"]) else None
+    last_archived = previous.get("last_message_id")
+    if last_archived and high_water and high_water <= last_archived:
+        job["up_to_date"] = True
+        return job
+    if last_archived:
+        # Export exactly (last archived, newest seen]: --before is exclusive, so include the newest message.
+        job["after"] = last_archived
+        job["before"] = high_water + 1 if high_water else None
+        job["html_file"], job["pdf_file"] = export_file_paths(chat, save_directory, suffix=f"_after_{last_archived}")
+    elif high_water:
+        job["before"] = high_water + 1
+    return job
+
+def merge_pdfs(pdf_files, output_file):
+    """
+    Concatenates `pdf_files` into `output_file`. Requires the optional `pypdf` package.
+    """
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for pdf in pdf_files:
+        writer.append(pdf)
+    temp_path = f"{output_file}.tmp"
+    with open(temp_path, 'wb') as f:
+        writer.write(f)
+    writer.close()
+    os.replace(temp_path, output_file)
+
+async def finish_export_job(job, pdf_path):
+    """
+    Records the channel's new high-water mark after a successful render and, in merged mode,
+    appends the delta PDF to the previous cumulative one. Returns the PDF to hand on.
+    """
+    if INCREMENTAL_MODE not in ("delta", "merged"):
+        return pdf_path
+    if job["up_to_date"]:
+        console.print(f"[green]No new messages in {job['name']} since the last archive.[/green]")
+        return job["previous_pdf"] if INCREMENTAL_MODE == "merged" else None
+    if not pdf_path:
+        return None
+
+    final_pdf = pdf_path
+    if INCREMENTAL_MODE == "merged" and job["previous_pdf"] and job["after"] and not isinstance(pdf_path, list):
+        cumulative_pdf = export_file_paths(job["chat"], job["save_directory"])[1]
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, merge_pdfs, [job["previous_pdf"], pdf_path], cumulative_pdf)
+            os.remove(pdf_path)
+            final_pdf = cumulative_pdf
+        except ImportError:
+            console.print("[yellow]Warning: INCREMENTAL_MODE=merged needs the 'pypdf' package. Keeping the delta PDF.[/yellow]")
+        except Exception as e:
+            console.print(f"[red]Failed to merge {os.path.basename(pdf_path)} into {os.path.basename(cumulative_pdf)}: {e}. Keeping the delta PDF.[/red]")
+
+    if job["high_water"]:
+        entry = {"name": job["name"], "last_message_id": job["high_water"], "pdf": final_pdf}
+        if isinstance(final_pdf, list):
+            entry["pdf"] = job["previous_pdf"]
+        elif final_pdf == pdf_path and job["previous_pdf"] and INCREMENTAL_MODE == "merged":
+            # The merge failed; keep pointing at the cumulative PDF so the next run can merge into it.
+            entry["pdf"] = job["previous_pdf"]
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, update_archive_state, job["save_directory"], job["chat"].id, entry)
+        except (OSError, sqlite3.Error) as e:
+            console.print(f"[red]Failed to record archive state for {job['name']}: {e}[/red]")
+    return final_pdf
+
+# --- Shared Media Cache ---
+class MediaCache:
+    """
+    A size-capped media directory shared by all exports, with LRU eviction and hit statistics.
+
+    DiscordChatExporter names cached files after the media URL and skips downloading files that
+    already exist (--reuse-media), so the cache only has to track recency and size. Files referenced
+    by an export are pinned until that export has been rendered, so eviction never removes media a
+    pending PDF still needs. While exports run, only files that already existed when the oldest of
+    them started are evicted; an export that reused one of those finds it missing in record_export
+    and is run again.
+    """
+
+    STATS_FILE = ".cache_stats.json"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.pins = {}
+        self.active_exports = []  # snapshots of the running exports, oldest first
+        self.run_stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "bytes_downloaded": 0, "evicted_files": 0, "evicted_bytes": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def export_args(self):
+        return ["--media-dir", self.directory, "--reuse-media"]
+
+    def begin_export(self):
+        """
+        Marks an export as running and returns the cache snapshot to pass to record_export and end_export.
+        """
+        snapshot = self.snapshot()
+        self.active_exports.append(snapshot)
+        return snapshot
+
+    def end_export(self, snapshot):
+        self.active_exports = [active for active in self.active_exports if active is not snapshot]
+        self.evict()
+
+    def snapshot(self):
+        """
+        Returns {filename: size} for the files currently in the cache.
+        """
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    files[entry.name] = entry.stat().st_size
+        return files
+
+    def referenced_files(self, html_file):
+        """
+        Returns the cache filenames referenced by an exported HTML file.
+        """
+        marker = os.path.basename(self.directory)
+        pattern = re.compile(re.escape(marker) + r'[/\\]([^"\'\s)<>?#]+)')
+        names = set()
+        with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                for match in pattern.finditer(line):
+                    names.add(urllib.parse.unquote(match.group(1)))
+        return names
+
+    def record_export(self, html_file, before):
+        """
+        Updates hit/miss statistics and recency for an export and pins its media.
+        `before` is the snapshot taken just before the export ran. Returns the referenced files
+        that are no longer in the cache because they were evicted during the export.
+        """
+        after = self.snapshot()
+        all_referenced = self.referenced_files(html_file)
+        referenced = all_referenced & set(after)
+        now = time.time()
+        for name in referenced:
+            if name in before:
+                self.run_stats["hits"] += 1
+                self.run_stats["bytes_saved"] += after[name]
+                try:
+                    os.utime(os.path.join(self.directory, name), (now, now))
+                except OSError:
+                    pass
+            else:
+                self.run_stats["misses"] += 1
+                self.run_stats["bytes_downloaded"] += after[name]
+        self.pins[html_file] = referenced
+        return all_referenced - referenced
+
+    def pin_file(self, html_file, name):
+        """
+        Pins one cache file to an export that is still being written.
+        """
+        self.pins.setdefault(html_file, set()).add(name)
+
+    def pin(self, html_file):
+        """
+        Pins the media of an export that was not recorded by this process (e.g. one being resumed).
+        """
+        try:
+            self.pins[html_file] = self.referenced_files(html_file)
+        except OSError:
+            pass
+
+    def release(self, html_file):
+        self.pins.pop(html_file, None)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used, unpinned files until the cache fits in `max_bytes`.
+        Files added since the oldest running export started may be part of a running export and are kept.
+        """
+        pinned = set().union(*self.pins.values()) if self.pins else set()
+        evictable = set(self.active_exports[0]) if self.active_exports else None
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    total += stat.st_size
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        if total <= self.max_bytes:
+            return
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name in pinned or (evictable is not None and name not in evictable):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            self.run_stats["evicted_files"] += 1
+            self.run_stats["evicted_bytes"] += size
+
+    def save_stats(self):
+        """
+        Adds this run's statistics to the cumulative totals kept in the cache directory.
+        """
+        stats_path = os.path.join(self.directory, self.STATS_FILE)
+        try:
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        for key, value in self.run_stats.items():
+            totals[key] = totals.get(key, 0) + value
+        with open(f"{stats_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(totals, f, indent=2, sort_keys=True)
+        os.replace(f"{stats_path}.tmp", stats_path)
+        return totals
+
+    def print_stats(self):
+        stats = self.run_stats
+        lookups = stats["hits"] + stats["misses"]
+        if not lookups:
+            return
+        try:
+            totals = self.save_stats()
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not save media cache statistics: {e}[/yellow]")
+            totals = stats
+        total_lookups = totals.get("hits", 0) + totals.get("misses", 0)
+        console.print(Panel(
+            f"This run: {stats['hits']}/{lookups} media files reused ({stats['hits'] / lookups:.0%}), "
+            f"{stats['bytes_saved'] / 1024 / 1024:.1f} MB not downloaded, {stats['bytes_downloaded'] / 1024 / 1024:.1f} MB downloaded, "
+            f"{stats['evicted_files']} file(s) evicted.\n"
+            f"All runs: {totals.get('hits', 0)}/{total_lookups} reused ({totals.get('hits', 0) / max(1, total_lookups):.0%}), "
+            f"{totals.get('bytes_saved', 0) / 1024 / 1024:.1f} MB saved.",
+            title="[green]Media Cache[/green]", border_style="green"))
+        for key in stats:
+            stats[key] = 0
+
+_media_cache = None
+
+def get_media_cache():
+    """
+    Returns the shared media cache, or None if MEDIA_CACHE_DIR is not configured.
+    """
+    global _media_cache
+    if MEDIA_CACHE_DIR and _media_cache is None:
+        _media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
+    return _media_cache
+
+def print_media_cache_stats():
+    media_cache = get_media_cache()
+    if media_cache:
+        media_cache.print_stats()
+
+# --- Searchable Archive Index ---
+class ExportMessageParser(HTMLParser):
+    """
+    Incrementally extracts messages from a DiscordChatExporter or native HTML export.
+    Feed it the file in chunks; finished messages collect in `messages` as
+    (message_id, author_id, author_name, content) tuples for the caller to drain.
+    """
+
+    VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+    AUTHOR_CLASSES = {"chatlog__author", "author"}
+    CONTENT_CLASSES = {"chatlog__content", "content"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.messages = []
+        self._message_id = None
+        self._content = []
+        # DiscordChatExporter only prints the author on the first message of a group, so it carries over.
+        self._author_id = None
+        self._author_name = None
+        self._author_title = None
+        self._capture = None
+        self._depth = 0
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._capture:
+            if tag == "br":
+                self._text.append("\n")
+            elif tag not in self.VOID_ELEMENTS:
+                self._depth += 1
+            return
+        attrs = dict(attrs)
+        message_id = attrs.get("data-message-id") or ""
+        classes = set((attrs.get("class") or "").split())
+        if message_id.isdigit():
+            self._finish_message()
+            self._message_id = int(message_id)
+        elif self._message_id is None or tag in self.VOID_ELEMENTS:
+            return
+        elif classes & self.AUTHOR_CLASSES:
+            user_id = attrs.get("data-user-id") or ""
+            self._author_id = int(user_id) if user_id.isdigit() else None
+            self._author_title = attrs.get("title")
+            self._start_capture("author")
+        elif classes & self.CONTENT_CLASSES:
+            self._start_capture("content")
+
+    def handle_endtag(self, tag):
+        if not self._capture or tag in self.VOID_ELEMENTS:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            text = "".join(self._text).strip()
+            if self._capture == "author":
+                self._author_name = text or self._author_title
+            elif text:
+                self._content.append(text)
+            self._capture = None
+
+    def handle_data(self, data):
+        if self._capture:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._finish_message()
+
+    def _start_capture(self, kind):
+        self._capture = kind
+        self._depth = 1
+        self._text = []
+
+    def _finish_message(self):
+        if self._message_id is not None:
+            self.messages.append((self._message_id, self._author_id, self._author_name, "\n".join(self._content)))
+        self._message_id = None
+        self._content = []
+
+class ArchiveIndex:
+    """
+    SQLite database of archived messages, keyed by guild, channel, author and timestamp, with an
+    external-content FTS5 index over the message text, author and channel names kept in sync by triggers.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            guild_name TEXT,
+            channel_id INTEGER NOT NULL,
+            channel_name TEXT,
+            author_id INTEGER,
+            author_name TEXT,
+            timestamp TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_by_channel ON messages (channel_id, timestamp);
+        CREATE INDEX IF NOT EXISTS messages_by_guild ON messages (guild_id, timestamp);
+        CREATE INDEX IF NOT EXISTS messages_by_author ON messages (author_id, timestamp);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, author_name, channel_name, content='messages', content_rowid='message_id'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content, author_name, channel_name)
+            VALUES (new.message_id, new.content, new.author_name, new.channel_name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, author_name, channel_name)
+            VALUES ('delete', old.message_id, old.content, old.author_name, old.channel_name);
+        END;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Exports run concurrently; serialise this process's writers instead of waiting on SQLite's lock.
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            connection.executescript(self.SCHEMA)
+            self._schema_ready = True
+        return connection
+
+    def index_html_export(self, html_file, chat_info, after=None, before=None):
+        """
+        Replaces the channel's indexed messages in (after, before) with those in `html_file`.
+        The file is parsed in chunks and inserted in batches inside a single transaction.
+        Returns the number of messages indexed.
+        """
+        parser = ExportMessageParser()
+
+        def rows():
+            with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        parser.close()
+                    else:
+                        parser.feed(chunk)
+                    for message_id, author_id, author_name, content in parser.messages:
+                        timestamp = discord.utils.snowflake_time(message_id).isoformat(timespec="seconds")
+                        yield (message_id, chat_info["guild_id"], chat_info["guild_name"], chat_info["channel_id"],
+                               chat_info["channel_name"], author_id, author_name, timestamp, content)
+                    parser.messages = []
+                    if not chunk:
+                        return
+
+        count = 0
+        with self._lock:
+            connection = self.connect()
+            try:
+                with connection:
+                    connection.execute(
+                        "DELETE FROM messages WHERE channel_id = ? AND message_id > ? AND message_id < ?",
+                        (chat_info["channel_id"], after or 0, before or 2 ** 63 - 1),
+                    )
+                    batches = rows()
+                    while True:
+                        batch = list(itertools.islice(batches, ARCHIVE_INDEX_BATCH_SIZE))
+                        if not batch:
+                            break
+                        connection.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                        count += len(batch)
+            finally:
+                connection.close()
+        return count
+
+    def search(self, query, guild_id=None, channel_id=None, author=None, after=None, before=None, limit=20):
+        """
+        Runs an FTS5 query (words, "phrases", prefix*, AND/OR/NOT) and returns the best matches as dicts.
+        `after`/`before` are ISO timestamps; `author` matches the author's name as a substring.
+        """
+        conditions = ["messages_fts MATCH ?"]
+        parameters = [query]
+        for column, operator, value in (("m.guild_id", "=", guild_id), ("m.channel_id", "=", channel_id),
+                                        ("m.timestamp", ">=", after), ("m.timestamp", "<", before)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                parameters.append(value)
+        if author:
+            conditions.append("m.author_name LIKE ?")
+            parameters.append(f"%{author}%")
+        sql = (
+            "SELECT m.message_id, m.guild_name, m.channel_name, m.author_name, m.timestamp, "
+            "snippet(messages_fts, 0, char(2), char(3), '…', 16) "
+            "FROM messages_fts JOIN messages m ON m.message_id = messages_fts.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY bm25(messages_fts) LIMIT ?"
+        )
+        connection = self.connect()
+        try:
+            rows = connection.execute(sql, [*parameters, limit]).fetchall()
+        finally:
+            connection.close()
+        keys = ("message_id", "guild_name", "channel_name", "author_name", "timestamp", "snippet")
+        return [dict(zip(keys, row)) for row in rows]
+
+_archive_index = None
+
+def get_archive_index():
+    """
+    Returns the shared archive index, or None if ARCHIVE_INDEX_FILE is not configured.
+    """
+    global _archive_index
+    if ARCHIVE_INDEX_FILE and _archive_index is None:
+        _archive_index = ArchiveIndex(ARCHIVE_INDEX_FILE)
+    return _archive_index
+
+async def index_export(job, html_file):
+    """
+    Adds an export's messages to the archive index, if one is configured. Failures only warn.
+    """
+    archive_index = get_archive_index()
+    if not archive_index:
+        return
+    chat = job["chat"]
+    guild = getattr(chat, 'guild', None)
+    chat_info = {
+        "guild_id": guild.id if guild else None, "guild_name": guild.name if guild else None,
+        "channel_id": chat.id, "channel_name": job["name"],
+    }
+    loop = asyncio.get_running_loop()
+    with metrics.stage("index", chat=job["name"]) as record:
+        try:
+            record["messages"] = await loop.run_in_executor(
+                None, archive_index.index_html_export, html_file, chat_info, job["after"], job["before"])
+        except (sqlite3.Error, OSError) as e:
+            record["ok"] = False
+            console.print(f"[yellow]Warning: Could not index {job['name']} in {ARCHIVE_INDEX_FILE}: {e}[/yellow]")
+            return
+    console.print(f"[green]Indexed {record['messages']} message(s) from {job['name']} in {record['seconds']:.1f}s.[/green]")
+
+async def export_chat_html(job, discord_token, dce_cli_path, on_progress=None):
+    """
+    Exports a channel to HTML with DiscordChatExporter and returns the HTML path, or None on failure.
+    `on_progress` is called with the export's completed fraction as DiscordChatExporter reports it.
+    """
+    with metrics.stage("export", chat=job["name"], exporter=EXPORTER) as record:
+        if EXPORTER == "native":
+            html_file = await export_chat_html_native(job)
+        else:
+            html_file = await export_chat_html_dce(job, discord_token, dce_cli_path, stats=record, on_progress=on_progress)
+        record["ok"] = bool(html_file)
+        if html_file:
+            try:
+                media_dir = media_directory_for(html_file)
+                record["bytes"] = path_size(html_file) + (path_size(media_dir) if os.path.isdir(media_dir) else 0)
+                record["messages"] = job["message_count"] = count_exported_messages(html_file)
+            except OSError:
+                pass
+    if html_file:
+        await index_export(job, html_file)
+    return html_file
+
+async def export_chat_html_dce(job, discord_token, dce_cli_path, stats=None, on_progress=None):
+    """
+    Runs DiscordChatExporter for an export job and returns the HTML path, or None on failure.
+    """
+
+    chat = job["chat"]
+    channel_name_for_file = job["name"]
+    html_file = job["html_file"]
+
+    console.print(Rule(f"[bold cyan]Exporting to HTML for {channel_name_for_file}[/bold cyan]"))
+    export_command = [dce_cli_path, "export", "-t", discord_token, "-c", str(chat.id), "-o", html_file, "--media", "--markdown"]
+    if job["after"]:
+        export_command.extend(["--after", str(job["after"])])
+    if job["before"]:
+        export_command.extend(["--before", str(job["before"])])
+    media_cache = get_media_cache()
+    cache_snapshot = None
+    if media_cache:
+        export_command.extend(media_cache.export_args())
+        cache_snapshot = media_cache.begin_export()
+
+    try:
+        for attempt in (1, 2):
+            if not await run_command(export_command, f"DiscordChatExporter for {channel_name_for_file}", timeout=EXPORT_TIMEOUT, stats=stats,
+                                     log_file=command_log_path(job, "export"), on_progress=on_progress):
+                return None
+            if not os.path.exists(html_file):
+                # DiscordChatExporter succeeds without writing a file when the range holds no messages.
+                job["empty"] = True
+                return None
+            if not media_cache:
+                return html_file
+            try:
+                missing = media_cache.record_export(html_file, cache_snapshot)
+            except OSError as e:
+                console.print(f"[yellow]Warning: Could not update the media cache for {channel_name_for_file}: {e}[/yellow]")
+                return html_file
+            if not missing:
+                return html_file
+            if attempt == 2:
+                console.print(f"[yellow]Warning: {len(missing)} media file(s) of {channel_name_for_file} are missing from the media cache.[/yellow]")
+                return html_file
+            # Another export's cleanup evicted media this export reused; export again so they are downloaded.
+            console.print(f"[yellow]{len(missing)} cached media file(s) of {channel_name_for_file} were evicted during the export. Exporting again.[/yellow]")
+            media_cache.end_export(cache_snapshot)
+            cache_snapshot = media_cache.begin_export()
+    finally:
+        if media_cache:
+            media_cache.end_export(cache_snapshot)
+
+# --- Partitioned Archiving ---
+async def fetch_oldest_message_id(chat):
+    """
+    Returns the ID of the oldest message in `chat`, or None if it has no messages.
+    """
+    try:
+        async for message in chat.history(limit=1, oldest_first=True):
+            return message.id
+    except discord.HTTPException as e:
+        console.print(f"[yellow]Warning: Could not fetch the oldest message of {chat_display_name(chat)}: {e}[/yellow]")
+    return None
+
+async def plan_partitions(job):
+    """
+    Splits an export job's message range into windows of PARTITION_DAYS days, widened so there are
+    at most PARTITION_MAX_WINDOWS of them. Returns a list of partition jobs, or [job] if the range
+    fits in a single window.
+    """
+    if not PARTITION_DAYS or PARTITION_DAYS <= 0:
+        return [job]
+    chat = job["chat"]
+    oldest_id = job["after"] + 1 if job["after"] else await fetch_oldest_message_id(chat)
+    newest_id = job["before"] or ((job["high_water"] or await fetch_latest_message_id(chat) or 0) + 1)
+    if not oldest_id or newest_id <= 1:
+        return [job]
+
+    start = discord.utils.snowflake_time(oldest_id)
+    end = discord.utils.snowflake_time(newest_id)
+    window = timedelta(days=PARTITION_DAYS)
+    if end - start <= window:
+        return [job]
+    window = max(window, (end - start) / PARTITION_MAX_WINDOWS)
+
+    boundaries = []
+    cursor = start
+    while cursor < end:
+        boundaries.append(cursor)
+        cursor += window
+
+    base = os.path.splitext(job["pdf_file"])[0]
+    parts = []
+    for number, window_start in enumerate(boundaries, 1):
+        part = dict(job)
+        part["part"] = number
+        part["html_file"] = f"{base}_part{number:03d}.html"
+        part["pdf_file"] = f"{base}_part{number:03d}.pdf"
+        # --after and --before are both exclusive message ID bounds.
+        part["after"] = job["after"] if number == 1 else discord.utils.time_snowflake(window_start, high=False) - 1
+        part["before"] = job["before"] if number == len(boundaries) else discord.utils.time_snowflake(boundaries[number], high=False)
+        parts.append(part)
+    return parts
+
+async def archive_partitions(job, parts, discord_token, dce_cli_path, status_callback=None):
+    """
+    Exports and renders the partitions of a job in parallel, then combines them. Partitions whose
+    date range holds no messages are dropped. Returns the merged PDF path, a list of numbered
+    partition PDFs, or None on failure.
+    """
+    semaphore = asyncio.Semaphore(PARTITION_WORKERS)
+    finished = 0
+
+    async def run_part(part):
+        nonlocal finished
+        async with semaphore:
+            description = f"{job['name']} (part {part['part']}/{len(parts)})"
+            try:
+                if not await export_chat_html(part, discord_token, dce_cli_path):
+                    return None
+                if part.get("message_count") == 0:
+                    part["empty"] = True
+                    return None
+                return await render_html_to_pdf(part["html_file"], part["pdf_file"], description,
+                                                log_file=command_log_path(part, "render"))
+            finally:
+                cleanup_export_files(part["html_file"])
+                finished += 1
+                if status_callback:
+                    status_callback(f"Partitions {finished}/{len(parts)}")
+
+    if status_callback:
+        status_callback(f"Partitions 0/{len(parts)}")
+    results = await asyncio.gather(*(run_part(part) for part in parts))
+    failed = [part for part, pdf in zip(parts, results) if not pdf and not part.get("empty")]
+    part_pdfs = [pdf for pdf in results if pdf]
+    if failed or not part_pdfs:
+        if failed:
+            console.print(f"[bold red]{len(failed)} of {len(parts)} partition(s) of {job['name']} failed.[/bold red]")
+        else:
+            console.print(f"[bold red]No partition of {job['name']} contained any messages.[/bold red]")
+        for pdf in part_pdfs:
+            if os.path.exists(pdf):
+                os.remove(pdf)
+        return None
+    if len(part_pdfs) < len(parts):
+        console.print(f"[cyan]Skipped {len(parts) - len(part_pdfs)} partition(s) of {job['name']} without messages.[/cyan]")
+
+    if PARTITION_OUTPUT == "numbered":
+        return part_pdfs
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, merge_pdfs, part_pdfs, job["pdf_file"])
+    except ImportError:
+        console.print("[yellow]Warning: Merging partitions needs the 'pypdf' package. Keeping numbered PDFs.[/yellow]")
+        return part_pdfs
+    except Exception as e:
+        console.print(f"[red]Failed to merge the partitions of {job['name']}: {e}. Keeping numbered PDFs.[/red]")
+        return part_pdfs
+    for pdf in part_pdfs:
+        os.remove(pdf)
+    return job["pdf_file"]
+
+# --- Native discord.py Exporter ---
+NATIVE_EXPORT_CSS = """
+body { font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; font-size: 11pt; color: #2e3338; margin: 1.5em; }
+h1 { font-size: 16pt; border-bottom: 1px solid #ccc; padding-bottom: 0.3em; }
+.message { display: flex; margin: 0.6em 0; page-break-inside: avoid; }
+.avatar { width: 32px; height: 32px; border-radius: 50%; margin-right: 0.7em; flex-shrink: 0; }
+.author { font-weight: bold; }
+.timestamp { color: #747f8d; font-size: 8pt; margin-left: 0.5em; }
+.content { white-space: pre-wrap; word-wrap: break-word; }
+.attachment img { max-width: 100%; max-height: 400px; margin-top: 0.3em; }
+.embed { border-left: 4px solid #ccc; padding-left: 0.6em; margin-top: 0.3em; color: #4f5660; }
+.reply { color: #747f8d; font-size: 9pt; }
+"""
+
+async def _download_native_media(semaphore, asset_or_attachment, path):
+    """
+    Saves an attachment or avatar to `path` unless it is already there (e.g. in the media cache).
+    """
+    try:
+        if not os.path.exists(path):
+            await asset_or_attachment.save(path)
+    except (discord.HTTPException, OSError, ValueError) as e:
+        console.print(f"[yellow]Warning: Could not download {os.path.basename(path)}: {e}[/yellow]")
+    finally:
+        semaphore.release()
+
+async def export_chat_html_native(job):
+    """
+    Exports a channel to HTML by streaming `channel.history()` through the bot's own session.
+    Messages are written to disk as they arrive, so the history is never held in memory, and
+    media downloads run in the background with at most NATIVE_MEDIA_CONCURRENCY in flight.
+    Returns the HTML path, or None on failure.
+    """
+    chat = job["chat"]
+    html_file = job["html_file"]
+    console.print(Rule(f"[bold cyan]Exporting to HTML for {job['name']} (native)[/bold cyan]"))
+
+    media_cache = get_media_cache()
+    media_dir = media_cache.directory if media_cache else media_directory_for(html_file)
+    os.makedirs(media_dir, exist_ok=True)
+    html_dir = os.path.dirname(os.path.abspath(html_file))
+    cache_snapshot = media_cache.begin_export() if media_cache else None
+
+    semaphore = asyncio.Semaphore(NATIVE_MEDIA_CONCURRENCY)
+    downloads = set()
+    seen_media = {}
+
+    async def local_media(key, source, filename):
+        # Returns the relative path used in the HTML and schedules the download once per file.
+        if key not in seen_media:
+            path = os.path.join(media_dir, sanitize_filename(filename))
+            seen_media[key] = os.path.relpath(path, html_dir).replace(os.sep, '/')
+            if media_cache:
+                media_cache.pin_file(html_file, os.path.basename(path))
+            await semaphore.acquire()
+            task = asyncio.create_task(_download_native_media(semaphore, source, path))
+            downloads.add(task)
+            task.add_done_callback(downloads.discard)
+        return seen_media[key]
+
+    async def render_message(message):
+        author = message.author
+        avatar = author.display_avatar
+        avatar_src = await local_media(f"avatar:{avatar.key}", avatar, f"avatar_{avatar.key}.png")
+        parts = [
+            f'<div class="message" data-message-id="{message.id}">',
+            f'<img class="avatar" src="{html.escape(urllib.parse.quote(avatar_src))}">',
+            '<div class="body">',
+        ]
+        if message.reference and isinstance(message.reference.resolved, discord.Message):
+            replied = message.reference.resolved
+            parts.append(f'<div class="reply">&#8627; {html.escape(replied.author.display_name)}: {html.escape(replied.clean_content[:120])}</div>')
+        parts.append(
+            f'<span class="author" data-user-id="{author.id}" title="{html.escape(author.name)}">{html.escape(author.display_name)}</span>'
+            f'<span class="timestamp">{message.created_at.strftime("%Y-%m-%d %H:%M")}'
+            f'{" (edited)" if message.edited_at else ""}</span>'
+        )
+        if message.clean_content:
+            parts.append(f'<div class="content">{html.escape(message.clean_content)}</div>')
+        for attachment in message.attachments:
+            src = await local_media(f"attachment:{attachment.id}", attachment, f"{attachment.id}_{attachment.filename}")
+            quoted = html.escape(urllib.parse.quote(src))
+            if (attachment.content_type or "").startswith("image/"):
+                parts.append(f'<div class="attachment"><img src="{quoted}" alt="{html.escape(attachment.filename)}"></div>')
+            else:
+                parts.append(f'<div class="attachment"><a href="{quoted}">{html.escape(attachment.filename)}</a> ({attachment.size} bytes)</div>')
+        for embed in message.embeds:
+            text = " — ".join(html.escape(t) for t in (embed.title, embed.description) if t)
+            if text:
+                parts.append(f'<div class="embed">{text}</div>')
+        parts.append('</div></div>\n')
+        return "".join(parts)
+
+    history_kwargs = {"limit": None, "oldest_first": True}
+    if job["after"]:
+        history_kwargs["after"] = discord.Object(id=job["after"])
+    if job["before"]:
+        history_kwargs["before"] = discord.Object(id=job["before"])
+
+    message_count = 0
+    try:
+        with open(html_file, 'w', encoding='utf-8') as f:
+            title = html.escape(job["name"])
+            guild_name = html.escape(chat.guild.name) if getattr(chat, 'guild', None) else "Direct Messages"
+            f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>'
+                    f'<style>{NATIVE_EXPORT_CSS}</style></head><body><h1>{guild_name} / {title}</h1>\n')
+            async for message in chat.history(**history_kwargs):
+                f.write(await render_message(message))
+                message_count += 1
+            f.write(f'<p class="timestamp">{message_count} message(s) exported.</p></body></html>\n')
+        if downloads:
+            await asyncio.gather(*list(downloads))
+        if media_cache:
+            try:
+                media_cache.record_export(html_file, cache_snapshot)
+            except OSError as e:
+                console.print(f"[yellow]Warning: Could not update the media cache for {job['name']}: {e}[/yellow]")
+    except (discord.HTTPException, OSError) as e:
+        console.print(f"[bold red]Error:[/] Native export of {job['name']} failed: {e}", style="red")
+        return None
+    finally:
+        for task in list(downloads):
+            task.cancel()
+        if media_cache:
+            media_cache.end_export(cache_snapshot)
+
+    console.print(f"[green]Exported {message_count} message(s) from {job['name']}.[/green]")
+    return html_file
+
+# --- Warm WeasyPrint Render Pool ---
+# State loaded once per worker process by _init_render_worker and reused for every PDF.
+_render_worker_state = {}
+
+def _init_render_worker():
+    """
+    Pool initializer: imports WeasyPrint and prepares the page stylesheet and font configuration once.
+    Errors are stored rather than raised, since a failing initializer makes the pool respawn workers forever.
+    """
+    try:
+        from weasyprint import CSS, HTML
+        try:
+            from weasyprint.text.fonts import FontConfiguration
+        except ImportError:  # WeasyPrint < 53
+            from weasyprint.fonts import FontConfiguration
+        font_config = FontConfiguration()
+        _render_worker_state['HTML'] = HTML
+        _render_worker_state['font_config'] = font_config
+        _render_worker_state['stylesheet'] = CSS(string=PAGE_STYLESHEET, font_config=font_config)
+        # Render a tiny document so font discovery happens now rather than on the first real job.
+        HTML(string="<p>warm-up</p>").render(stylesheets=[_render_worker_state['stylesheet']], font_config=font_config)
+    except Exception as e:
+        _render_worker_state['error'] = f"{type(e).__name__}: {e}"
+
+def _render_in_worker(html_file, pdf_file):
+    """
+    Runs inside a pool worker: renders `html_file` to `pdf_file` with the preloaded WeasyPrint state.
+    """
+    if 'error' in _render_worker_state:
+        raise ImportError(_render_worker_state['error'])
+    HTML = _render_worker_state['HTML']
+    HTML(filename=html_file, encoding='utf-8').write_pdf(
+        pdf_file,
+        stylesheets=[_render_worker_state['stylesheet']],
+        font_config=_render_worker_state['font_config'],
+    )
+    return pdf_file, read_peak_rss(os.getpid())
+
+class RenderPool:
+    """
+    A lazily started pool of pre-warmed WeasyPrint worker processes.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = None
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            options = {}
+            if sys.version_info >= (3, 11):
+                options["max_tasks_per_child"] = RENDER_TASKS_PER_WORKER
+            # "spawn" avoids forking a process that is running the asyncio loop and discord.py threads.
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_render_worker, **options)
+        return self._pool
+
+    async def render(self, html_file, pdf_file, timeout=None):
+        """
+        Renders `html_file` to `pdf_file` in a worker process without blocking the event loop.
+        Returns (pdf_file, the worker's peak RSS in bytes or None). On timeout the workers are killed, and if a
+        worker dies (e.g. killed for running out of memory) the pool is broken; either way a fresh pool starts on next use.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._ensure_pool()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(pool, _render_in_worker, html_file, pdf_file), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.terminate(pool)
+            raise
+        except concurrent.futures.process.BrokenProcessPool:
+            self.terminate(pool)
+            raise
+
+    def terminate(self, pool):
+        """
+        Kills `pool`'s workers without waiting for them. Renders running alongside the killed one fail with BrokenProcessPool.
+        """
+        if self._pool is pool:
+            self._pool = None
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            if process.is_alive():
+                process.kill()
+        pool.shutdown(wait=False)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+_render_pool = None
+_render_pool_disabled = False
+
+def use_render_pool():
+    """
+    Returns True if PDFs should be rendered by the warm worker pool rather than the weasyprint CLI.
+    """
+    if RENDER_BACKEND == "cli" or _render_pool_disabled:
+        return False
+    available = importlib.util.find_spec("weasyprint") is not None
+    if RENDER_BACKEND == "pool" and not available:
+        console.print("[yellow]Warning: RENDER_BACKEND=pool but the weasyprint library is not installed. Using the CLI.[/yellow]")
+    return available
+
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = RenderPool(RENDER_WORKERS)
+    return _render_pool
+
+def close_render_pool():
+    """
+    Shuts down the render worker processes, if they were started.
+    """
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.close()
+        _render_pool = None
+
+# --- Media Downscaling ---
+def _downscale_image(path, max_width, quality):
+    """
+    Runs in a worker process: shrinks one image in place to at most `max_width` pixels wide and
+    recompresses it. The file is only replaced when the result is smaller. Returns (old, new) sizes.
+    """
+    from PIL import Image, ImageOps
+    old_size = os.path.getsize(path)
+    with Image.open(path) as image:
+        image_format = image.format
+        if image_format not in ("JPEG", "PNG", "WEBP") or getattr(image, "is_animated", False):
+            return old_size, old_size
+        if image.width <= max_width and image_format == "PNG":
+            return old_size, old_size
+        image = ImageOps.exif_transpose(image)
+        if image.width > max_width:
+            image.thumbnail((max_width, max(1, round(image.height * max_width / image.width))), Image.LANCZOS)
+        save_options = {"optimize": True} if image_format == "PNG" else {"quality": quality, "optimize": True}
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        temp_path = f"{path}.downscale"
+        image.save(temp_path, format=image_format, **save_options)
+    new_size = os.path.getsize(temp_path)
+    if new_size < old_size:
+        os.replace(temp_path, path)
+        return old_size, new_size
+    os.remove(temp_path)
+    return old_size, old_size
+
+_downscale_pool = None
+
+def get_downscale_pool():
+    global _downscale_pool
+    if _downscale_pool is None:
+        _downscale_pool = concurrent.futures.ProcessPoolExecutor(
+            MEDIA_DOWNSCALE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _downscale_pool
+
+def close_downscale_pool():
+    """
+    Shuts down the image downscaling worker processes, if they were started.
+    """
+    global _downscale_pool
+    if _downscale_pool is not None:
+        _downscale_pool.shutdown()
+        _downscale_pool = None
+
+async def downscale_export_media(html_file, description):
+    """
+    Downscales and recompresses the images in the export's _attachments directory in parallel,
+    so WeasyPrint decodes and embeds no more pixels than the page can show at MEDIA_DOWNSCALE_DPI.
+    Does nothing unless MEDIA_DOWNSCALE_DPI is set and Pillow is installed.
+    """
+    media_dir = media_directory_for(html_file)
+    if not MEDIA_DOWNSCALE_DPI or MEDIA_DOWNSCALE_DPI <= 0 or not os.path.isdir(media_dir):
+        return
+    if importlib.util.find_spec("PIL") is None:
+        console.print("[yellow]Warning: MEDIA_DOWNSCALE_DPI is set but Pillow is not installed. Skipping downscaling.[/yellow]")
+        return
+    images = [os.path.join(media_dir, name) for name in os.listdir(media_dir)
+              if os.path.splitext(name)[1].lower() in (".jpg", ".jpeg", ".png", ".webp")]
+    if not images:
+        return
+
+    max_width = max(1, int(PAGE_WIDTH_INCHES * MEDIA_DOWNSCALE_DPI))
+    loop = asyncio.get_running_loop()
+    with metrics.stage("downscale", chat=description, images=len(images)) as record:
+        results = await asyncio.gather(
+            *(loop.run_in_executor(get_downscale_pool(), _downscale_image, path, max_width, MEDIA_DOWNSCALE_QUALITY) for path in images),
+            return_exceptions=True,
+        )
+        sizes = [result for result in results if not isinstance(result, BaseException)]
+        old_bytes = sum(old for old, _ in sizes)
+        saved = old_bytes - sum(new for _, new in sizes)
+        record.update(bytes=saved, original_bytes=old_bytes, failed=len(results) - len(sizes))
+    if sizes and old_bytes:
+        console.print(f"[green]Downscaled media for {description}: {saved / 1024 / 1024:.1f} MB saved "
+                      f"({saved / old_bytes:.0%} of {old_bytes / 1024 / 1024:.1f} MB) in {record['seconds']:.1f}s.[/green]")
+    if len(sizes) < len(results):
+        console.print(f"[yellow]Warning: {len(results) - len(sizes)} image(s) of {description} could not be downscaled.[/yellow]")
+
+async def render_html_to_pdf(html_file, pdf_file, description, log_file=None):
+    """
+    Converts an exported HTML file to PDF with WeasyPrint and returns the PDF path, or None on failure.
+    The weasyprint CLI's output goes to `log_file`, if given.
+    """
+    await downscale_export_media(html_file, description)
+    with metrics.stage("render", chat=description, downscaled=bool(MEDIA_DOWNSCALE_DPI)) as record:
+        pdf_path = await _render_html_to_pdf(html_file, pdf_file, description, record, log_file)
+        record["ok"] = bool(pdf_path)
+        if pdf_path:
+            record["bytes"] = path_size(pdf_path)
+        return pdf_path
+
+async def _render_html_to_pdf(html_file, pdf_file, description, stats, log_file):
+    """
+    Uses the warm render pool when available and falls back to the weasyprint CLI otherwise.
+    """
+    global _render_pool_disabled
+    console.print(Rule(f"[bold cyan]Converting to PDF for {description}[/bold cyan]"))
+    if use_render_pool():
+        try:
+            _, stats["peak_rss_bytes"] = await get_render_pool().render(html_file, pdf_file, timeout=RENDER_TIMEOUT)
+            stats["backend"] = "pool"
+            return pdf_file if os.path.exists(pdf_file) else None
+        except asyncio.TimeoutError:
+            console.print(f"[bold red]Error:[/] WeasyPrint conversion for {description} timed out after [bold]{RENDER_TIMEOUT}[/bold] seconds.", style="red")
+            return None
+        except ImportError as e:
+            _render_pool_disabled = True
+            close_render_pool()
+            console.print(f"[yellow]Warning: WeasyPrint library could not be loaded ({e}). Falling back to the CLI.[/yellow]")
+        except Exception as e:
+            console.print(f"[bold red]Error:[/] WeasyPrint conversion for {description} failed: {e}", style="red")
+            return None
+    stats["backend"] = "cli"
+    return await render_html_to_pdf_cli(html_file, pdf_file, description, stats=stats, log_file=log_file)
+
+async def render_html_to_pdf_cli(html_file, pdf_file, description, stats=None, log_file=None):
+    """
+    Converts an exported HTML file to PDF by running the weasyprint command.
+    """
+    weasyprint_args = []
+    temp_css_file = None
+    try:
+        temp_css_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.css', encoding='utf-8')
+        temp_css_file.write(PAGE_STYLESHEET)
+        temp_css_file.close()
+        weasyprint_args.extend(["--stylesheet", temp_css_file.name])
+    except Exception as e:
+        console.print(f"[bold red]Error creating temporary stylesheet for margins: {e}[/bold red]")
+
+    convert_command = ["weasyprint", *weasyprint_args, "--encoding", "utf-8", html_file, pdf_file]
+
+    pdf_path = None
+    try:
+        if await run_command(convert_command, f"WeasyPrint Conversion for {description}", timeout=RENDER_TIMEOUT, stats=stats, log_file=log_file):
+            if os.path.exists(pdf_file):
+                pdf_path = pdf_file
+    finally:
+        if temp_css_file and os.path.exists(temp_css_file.name):
+            os.remove(temp_css_file.name)
+    return pdf_path
+
+def cleanup_export_files(html_file):
+    """
+    Removes the intermediate HTML export and its downloaded media.
+    Media in the shared cache is kept; only this export's pins on it are released.
+    """
+    media_cache = get_media_cache()
+    if media_cache:
+        media_cache.release(html_file)
+    try:
+        if os.path.exists(html_file):
+            os.remove(html_file)
+        media_dir = media_directory_for(html_file)
+        if os.path.isdir(media_dir):
+            shutil.rmtree(media_dir)
+    except OSError as e:
+        console.print(f"[bold red]Error during cleanup: {e}[/bold red]")
+
+async def archive_one_channel(chat_to_process, discord_token, save_directory, dce_cli_path, status_callback=None):
+    """
+    Archives a single channel to a PDF and returns the file path (a list of paths for numbered partitions).
+    `status_callback`, if given, is called with a short description of the current stage.
+    """
+    with metrics.stage("archive", chat=chat_display_name(chat_to_process)) as record:
+        result = await _archive_one_channel(chat_to_process, discord_token, save_directory, dce_cli_path, status_callback)
+        record["ok"] = bool(result)
+    metrics.write_reports()
+    return result
+
+async def archive_one_channel_with_progress(chat_to_process, discord_token, save_directory, dce_cli_path):
+    """
+    Runs archive_one_channel under a live status line showing its stage and export progress.
+    """
+    name = chat_display_name(chat_to_process)
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), console=console) as progress:
+        task = progress.add_task(f"[cyan]{name}: Starting[/cyan]", total=None)
+        return await archive_one_channel(chat_to_process, discord_token, save_directory, dce_cli_path,
+                                         status_callback=lambda status: progress.update(task, description=f"[cyan]{name}: {status}[/cyan]"))
+
+async def _archive_one_channel(chat_to_process, discord_token, save_directory, dce_cli_path, status_callback):
+    def report(status):
+        if status_callback:
+            status_callback(status)
+
+    channel_name_for_file = chat_display_name(chat_to_process)
+    console.print(Rule(f"[bold cyan]Processing: {channel_name_for_file} (ID: {chat_to_process.id})[/bold cyan]"))
+    job = await prepare_export_job(chat_to_process, save_directory)
+    if job["up_to_date"]:
+        report("Up to date")
+        return await finish_export_job(job, None)
+
+    parts = await plan_partitions(job)
+    if len(parts) > 1:
+        console.print(f"[cyan]Splitting {channel_name_for_file} into {len(parts)} date-range partition(s).[/cyan]")
+        result = await archive_partitions(job, parts, discord_token, dce_cli_path, status_callback=status_callback)
+        print_media_cache_stats()
+        return await finish_export_job(job, result)
+
+    # --- Export Discord chat to HTML ---
+    report("Exporting")
+    try:
+        if not await export_chat_html(job, discord_token, dce_cli_path,
+                                      on_progress=lambda fraction: report(f"Exporting {fraction:.0%}")):
+            return None
+
+        # --- Convert HTML to PDF ---
+        report("Converting")
+        pdf_path = await render_html_to_pdf(job["html_file"], job["pdf_file"], channel_name_for_file,
+                                            log_file=command_log_path(job, "render"))
+    finally:
+        # --- Cleanup ---
+        cleanup_export_files(job["html_file"])
+    print_media_cache_stats()
+    return await finish_export_job(job, pdf_path)
+
+# --- Rate-Limit Aware Send Scheduler ---
+class SendScheduler:
+    """
+    Runs Discord sends concurrently, retrying rate limits and transient failures.
+
+    Sends to different destinations run in parallel (up to SEND_CONCURRENCY); sends to the same
+    destination share a per-destination limit. A 429 pauses only its destination, unless Discord
+    marks it global, in which case every send waits. Other retryable errors back off exponentially
+    with full jitter, starting at INITIAL_DELAY and giving up after MAX_RETRIES retries.
+    """
+
+    def __init__(self, concurrency=SEND_CONCURRENCY, per_destination=SEND_PER_DESTINATION,
+                 max_retries=MAX_RETRIES, initial_delay=INITIAL_DELAY):
+        self.concurrency = concurrency
+        self.per_destination = per_destination
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self._semaphore = None
+        self._destination_semaphores = {}
+        self._resume_at = {}
+        self._global_resume_at = 0.0
+        self.stats = {"sends": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    @staticmethod
+    def _retry_after(error):
+        """
+        Returns (seconds, is_global) from a rate limit error, or (None, False) if it is not one.
+        """
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after, False
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            headers = getattr(error.response, 'headers', None) or {}
+            delay = headers.get('Retry-After') or headers.get('X-RateLimit-Reset-After')
+            try:
+                delay = float(delay) if delay is not None else None
+            except ValueError:
+                delay = None
+            return delay, str(headers.get('X-RateLimit-Global', '')).lower() == 'true'
+        return None, False
+
+    @staticmethod
+    def _is_transient(error):
+        if isinstance(error, discord.HTTPException):
+            return error.status >= 500 or error.status == 429
+        return isinstance(error, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientError))
+
+    async def send(self, destination_key, make_request, description="message", size=0):
+        """
+        Performs `make_request()` (which must create a fresh request coroutine each call, since
+        files cannot be re-read after a failed upload) with retries. Returns its result or raises
+        the last error. `size` is the number of bytes uploaded, for the metrics report.
+        """
+        with metrics.stage("send", destination=str(destination_key), description=description, bytes=size) as record:
+            record["retries"] = 0
+            return await self._send(destination_key, make_request, description, record)
+
+    async def _send(self, destination_key, make_request, description, record):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        destination_semaphore = self._destination_semaphores.setdefault(destination_key, asyncio.Semaphore(self.per_destination))
+
+        attempt = 0
+        async with destination_semaphore:
+            while True:
+                wait = max(self._resume_at.get(destination_key, 0.0), self._global_resume_at) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    async with self._semaphore:
+                        self.stats["sends"] += 1
+                        return await make_request()
+                except Exception as e:
+                    retry_after, is_global = self._retry_after(e)
+                    if attempt >= self.max_retries or not (retry_after is not None or self._is_transient(e)):
+                        self.stats["failures"] += 1
+                        raise
+                    attempt += 1
+                    record["retries"] = attempt
+                    self.stats["retries"] += 1
+                    if retry_after is not None:
+                        self.stats["rate_limited"] += 1
+                        delay = retry_after + random.uniform(0, 0.25)
+                        resume_at = loop.time() + delay
+                        if is_global:
+                            self._global_resume_at = max(self._global_resume_at, resume_at)
+                        else:
+                            self._resume_at[destination_key] = max(self._resume_at.get(destination_key, 0.0), resume_at)
+                    else:
+                        delay = random.uniform(0, min(MAX_DELAY, self.initial_delay * (2 ** (attempt - 1))))
+                        await asyncio.sleep(delay)
+                    console.print(f"[yellow]Retrying {description} in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1}): {e}[/yellow]")
+
+send_scheduler = SendScheduler()
+
+def _destination_key(destination):
+    return getattr(destination, 'id', id(destination))
+
+async def send_files(destination, paths, content=None):
+    """
+    Sends up to MAX_ATTACHMENTS_PER_MESSAGE files (with optional text) in one message through the send scheduler.
+    """
+    filenames = [os.path.basename(path) for path in paths]
+
+    async def make_request():
+        handles = [open(path, 'rb') for path in paths]
+        try:
+            files = [discord.File(f, filename=filename) for f, filename in zip(handles, filenames)]
+            return await destination.send(content=content, files=files)
+        finally:
+            for f in handles:
+                f.close()
+
+    return await send_scheduler.send(_destination_key(destination), make_request, description=f"upload of {', '.join(filenames)}",
+                                     size=sum(os.path.getsize(path) for path in paths))
+
+async def send_file(destination, path, content=None):
+    """
+    Sends a file (with optional text) to a channel or member through the send scheduler.
+    """
+    return await send_files(destination, [path], content=content)
+
+async def send_message(destination, content):
+    """
+    Sends a text message to a channel or member through the send scheduler.
+    """
+    return await send_scheduler.send(_destination_key(destination), lambda: destination.send(content), description="message")
+
+# Attachment URLs of PDFs already posted to Discord, so later steps can link instead of re-uploading.
+# Entries are {path: ((mtime, size), [urls])}; a PDF regenerated at the same path no longer matches.
+uploaded_pdf_urls = {}
+
+def pdf_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def remember_uploaded_pdf(pdf, urls):
+    uploaded_pdf_urls[pdf] = (pdf_fingerprint(pdf), urls)
+
+def uploaded_urls(pdf):
+    """
+    Returns the attachment URLs of `pdf` if this version of the file was posted, else None.
+    """
+    fingerprint, urls = uploaded_pdf_urls.get(pdf, (None, None))
+    if fingerprint is None or fingerprint != pdf_fingerprint(pdf):
+        return None
+    return urls
+
+def upload_size_limit(destination):
+    """
+    Returns the number of bytes that can be attached to one message sent to `destination`.
+    """
+    if UPLOAD_SIZE_LIMIT:
+        limit = UPLOAD_SIZE_LIMIT * 1024 * 1024
+    else:
+        guild = getattr(destination, 'guild', None)
+        limit = getattr(guild, 'filesize_limit', None) or DEFAULT_UPLOAD_LIMIT
+    return int(limit * UPLOAD_SIZE_MARGIN)
+
+def _compress_pdf(pdf, output_file):
+    from pypdf import PdfReader, PdfWriter
+    writer = PdfWriter(clone_from=PdfReader(pdf))
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    with open(output_file, 'wb') as f:
+        writer.write(f)
+
+def _split_pdf(pdf, size_limit):
+    """
+    Splits `pdf` into consecutive page ranges that each fit in `size_limit` bytes.
+    Returns the part paths, or None if a single page is already too large.
+    """
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(pdf)
+    total_pages = len(reader.pages)
+    base = os.path.splitext(pdf)[0]
+    pages_per_part = max(1, int(total_pages * size_limit * 0.9 / max(1, os.path.getsize(pdf))))
+    parts = []
+    start = 0
+    while start < total_pages:
+        count = min(pages_per_part, total_pages - start)
+        while True:
+            part_file = f"{base}_upload{len(parts) + 1:02d}.pdf"
+            writer = PdfWriter()
+            for page in reader.pages[start:start + count]:
+                writer.add_page(page)
+            with open(part_file, 'wb') as f:
+                writer.write(f)
+            if os.path.getsize(part_file) <= size_limit:
+                break
+            if count == 1:
+                os.remove(part_file)
+                for part in parts:
+                    os.remove(part)
+                return None
+            count = max(1, count // 2)
+        parts.append(part_file)
+        start += count
+    return parts
+
+def fit_pdf_for_upload(pdf, size_limit):
+    """
+    Returns the file(s) to upload in place of `pdf` so that each fits in `size_limit` bytes:
+    the PDF itself, a recompressed copy, or page-range parts. Needs the optional `pypdf` package
+    for anything but the first case. Returns [] if the PDF cannot be made small enough.
+    """
+    if os.path.getsize(pdf) <= size_limit:
+        return [pdf]
+    try:
+        compressed = f"{os.path.splitext(pdf)[0]}_compressed.pdf"
+        _compress_pdf(pdf, compressed)
+        if os.path.getsize(compressed) <= size_limit:
+            return [compressed]
+        os.remove(compressed)
+        return _split_pdf(pdf, size_limit) or []
+    except ImportError:
+        console.print(f"[yellow]Warning: {os.path.basename(pdf)} exceeds the upload limit and 'pypdf' is not installed to shrink or split it.[/yellow]")
+    except Exception as e:
+        console.print(f"[red]Failed to shrink {os.path.basename(pdf)} for upload: {e}[/red]")
+    return []
+
+def plan_upload_batches(files, size_limit, max_files=MAX_ATTACHMENTS_PER_MESSAGE):
+    """
+    Packs files, in order, into messages of at most `max_files` attachments and `size_limit` bytes.
+    """
+    batches = []
+    current, current_size = [], 0
+    for path in files:
+        size = os.path.getsize(path)
+        if current and (len(current) >= max_files or current_size + size > size_limit):
+            batches.append(current)
+            current, current_size = [], 0
+        current.append(path)
+        current_size += size
+    if current:
+        batches.append(current)
+    return batches
+
+async def prepare_uploads(pdfs, size_limit):
+    """
+    Fits every PDF within `size_limit`. Returns ({pdf: [files to upload]}, [pdfs that cannot be uploaded]).
+    """
+    loop = asyncio.get_running_loop()
+    fitted = await asyncio.gather(*(loop.run_in_executor(None, fit_pdf_for_upload, pdf, size_limit) for pdf in pdfs))
+    upload_files = {pdf: files for pdf, files in zip(pdfs, fitted) if files}
+    return upload_files, [pdf for pdf, files in zip(pdfs, fitted) if not files]
+
+def cleanup_prepared_uploads(upload_files):
+    """
+    Removes the temporary compressed/split copies created by prepare_uploads.
+    """
+    for pdf, files in upload_files.items():
+        for path in files:
+            if path != pdf and os.path.exists(path):
+                os.remove(path)
+
+async def upload_pdfs(destination, pdfs, content=None, on_uploaded=None, prepared=None):
+    """
+    Uploads PDFs to `destination` in as few messages as Discord's attachment count and size limits
+    allow, shrinking or splitting oversized PDFs first. Batches are sent concurrently through the
+    send scheduler. `on_uploaded(pdf)` is called once every file of a PDF has been posted.
+    `prepared` is the result of an earlier prepare_uploads call, which the caller then cleans up.
+    Returns the list of PDFs that were fully uploaded.
+    """
+    size_limit = upload_size_limit(destination)
+    upload_files, unsendable = prepared or await prepare_uploads(pdfs, size_limit)
+    for pdf in unsendable:
+        console.print(f"[red]Skipping {os.path.basename(pdf)}: it does not fit within the {size_limit / 1024 / 1024:.1f} MB upload limit.[/red]")
+    source_of = {path: pdf for pdf, files in upload_files.items() for path in files}
+    remaining = {pdf: len(files) for pdf, files in upload_files.items()}
+    urls = {pdf: [] for pdf in upload_files}
+    uploaded = []
+
+    async def send_batch(number, batch):
+        message = await send_files(destination, batch, content=content if number == 0 else None)
+        for path, attachment in zip(batch, getattr(message, 'attachments', None) or []):
+            urls[source_of[path]].append(attachment.url)
+        for path in batch:
+            pdf = source_of[path]
+            remaining[pdf] -= 1
+            if remaining[pdf] == 0:
+                uploaded.append(pdf)
+                remember_uploaded_pdf(pdf, urls[pdf])
+                if on_uploaded:
+                    on_uploaded(pdf)
+
+    all_files = [path for pdf in pdfs for path in upload_files.get(pdf, [])]
+    batches = plan_upload_batches(all_files, size_limit)
+    results = await asyncio.gather(*(send_batch(number, batch) for number, batch in enumerate(batches)), return_exceptions=True)
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            console.print(f"[red]Failed to upload {', '.join(os.path.basename(path) for path in batch)}: {result}[/red]")
+
+    if not prepared:
+        cleanup_prepared_uploads(upload_files)
+    return [pdf for pdf in pdfs if pdf in uploaded]
+
+def split_message(header, lines, limit=MAX_MESSAGE_LENGTH):
+    """
+    Joins `header` and `lines` into as few messages as possible, each at most `limit` characters.
+    """
+    messages = []
+    current = header
+    for line in lines:
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+def archive_notice(chat):
+    """
+    Returns the text sent alongside an archived copy of `chat`.
+    """
+    notice = f"This is an archived copy of the Discord channel: "
+    if getattr(chat, 'guild', None):
+        notice += f"**Server:** {chat.guild.name}, "
+
+    if isinstance(chat, discord.Thread):
+        notice += f"**Channel:** #{chat.parent.name}, **Thread:** {chat.name}"
+    else:
+        notice += f"**Channel:** #{chat.name}"
+    notice += ".\n\nFor your records."
+    return notice
+
+async def fan_out_dms(members, pdfs, notice, progress=None, mode=None):
+    """
+    DMs `pdfs` with `notice` to every member concurrently, one message per member where possible.
+
+    In "link" mode each PDF is uploaded at most once: PDFs already posted to Discord are linked,
+    the rest are attached to the first member's DM and linked for everyone else. In "attach"
+    mode every member gets the files, batched MAX_ATTACHMENTS_PER_MESSAGE per message. Attachment
+    links are signed and expire, so "link" mode suits quick notifications rather than records.
+    Returns {member_id: error or None}.
+    """
+    mode = mode or DM_FANOUT_MODE
+    results = {}
+
+    def links():
+        return {pdf: uploaded_urls(pdf) for pdf in pdfs if uploaded_urls(pdf)}
+
+    linkable = {} if mode == "attach" else links()
+    attached = [pdf for pdf in pdfs if pdf not in linkable]
+    # DMs use the personal upload limit. Oversized PDFs are shrunk or split once for all members;
+    # PDFs that are only linked are left alone.
+    prepared = ({}, [])
+    if attached and members:
+        prepared = await prepare_uploads(attached, int((UPLOAD_SIZE_LIMIT * 1024 * 1024 if UPLOAD_SIZE_LIMIT else DEFAULT_UPLOAD_LIMIT) * UPLOAD_SIZE_MARGIN))
+    dm_task = progress.add_task("[cyan]Sending DMs...", total=len(members)) if progress else None
+    printer = progress.console if progress else console
+
+    async def attach_to(member, files):
+        upload_files, unsendable = prepared
+        subset = ({pdf: upload_files[pdf] for pdf in files if pdf in upload_files}, [pdf for pdf in files if pdf in unsendable])
+        sent = await upload_pdfs(member, files, content=notice, prepared=subset)
+        if len(sent) < len(files):
+            raise RuntimeError(f"{len(files) - len(sent)} PDF(s) could not be sent")
+
+    async def dm_member(member, attach, link):
+        try:
+            if attach:
+                await attach_to(member, attach)
+            if link:
+                # One line per URL: split_message never breaks a line, and a PDF split into many parts has many URLs.
+                lines = []
+                for pdf, urls in link.items():
+                    name = os.path.basename(pdf)
+                    lines.extend([f"{name}: {urls[0]}"] if len(urls) == 1 else
+                                 [f"{name} (part {number}/{len(urls)}): {url}" for number, url in enumerate(urls, 1)])
+                for text in split_message(None if attach else notice, lines):
+                    await send_message(member, text)
+            results[member.id] = None
+            printer.print(f"[green]DM sent to {member.display_name} ({len(pdfs)} PDF(s))[/green]")
+        except Exception as e:
+            results[member.id] = e
+            printer.print(f"[red]Failed to send DM to {member.display_name}: {e}[/red]")
+        if progress:
+            progress.update(dm_task, advance=1)
+
+    try:
+        if mode == "attach" or not members:
+            await asyncio.gather(*(dm_member(member, pdfs, {}) for member in members))
+            return results
+
+        # The first member receives whatever has not been uploaded yet; that upload is then linked for the rest.
+        first, rest = members[0], members[1:]
+        await dm_member(first, attached, linkable)
+        linkable = links()
+        unlinked = [pdf for pdf in pdfs if pdf not in linkable]
+        await asyncio.gather(*(dm_member(member, unlinked, linkable) for member in rest))
+        return results
+    finally:
+        cleanup_prepared_uploads(prepared[0])
+
+# --- Job Size Estimation ---
+class JobEstimator:
+    """
+    Estimates how many seconds exporting and rendering a chat will take, from cheap signals:
+    the chat's time in earlier runs, its previous PDF, a thread's message count, or the span
+    between the channel's creation and its last message ID. Rates are learned from the runs
+    recorded in ARCHIVE_ESTIMATES_FILE and fall back to rough defaults.
+    """
+
+    BASE_SECONDS = 2.0
+    DEFAULT_SECONDS_PER_MESSAGE = 0.01
+    DEFAULT_SECONDS_PER_PDF_MB = 4.0
+    DEFAULT_MESSAGES_PER_DAY = 20.0
+
+    def __init__(self, save_directory):
+        self.path = os.path.join(save_directory, ARCHIVE_ESTIMATES_FILE)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.history = json.load(f)
+        except (OSError, ValueError):
+            self.history = {}
+        self.save_directory = save_directory
+        self.seconds_per_message = self._rate("seconds", "messages", self.DEFAULT_SECONDS_PER_MESSAGE)
+        self.seconds_per_pdf_mb = self._rate("seconds", "pdf_mb", self.DEFAULT_SECONDS_PER_PDF_MB)
+        self.messages_per_day = self._rate("messages", "span_days", self.DEFAULT_MESSAGES_PER_DAY)
+
+    def _rate(self, numerator, denominator, default):
+        entries = [entry for entry in self.history.values() if entry.get(numerator) and entry.get(denominator)]
+        total = sum(entry[denominator] for entry in entries)
+        return sum(entry[numerator] for entry in entries) / total if total else default
+
+    @staticmethod
+    def _span_days(chat):
+        last_message_id = getattr(chat, 'last_message_id', None)
+        if not last_message_id:
+            return None
+        span = discord.utils.snowflake_time(last_message_id) - discord.utils.snowflake_time(chat.id)
+        return max(1.0, span.total_seconds() / 86400)
+
+    def estimate(self, chat):
+        """
+        Returns (estimated seconds, what the estimate is based on). The signals are tried in order:
+        the previous run, the previous PDF, the thread's message count, the message ID span.
+        """
+        entry = self.history.get(str(chat.id))
+        if entry and entry.get("seconds"):
+            return entry["seconds"], "previous run"
+        pdf_file = export_file_paths(chat, self.save_directory)[1]
+        if os.path.exists(pdf_file):
+            return self.BASE_SECONDS + os.path.getsize(pdf_file) / 1024 / 1024 * self.seconds_per_pdf_mb, "previous PDF"
+        messages = getattr(chat, 'message_count', None)
+        if messages is not None:
+            return self.BASE_SECONDS + messages * self.seconds_per_message, "message count"
+        span_days = self._span_days(chat)
+        if span_days is None:
+            return self.BASE_SECONDS, "empty"
+        return self.BASE_SECONDS + span_days * self.messages_per_day * self.seconds_per_message, "message ID span"
+
+    def record(self, chat, seconds, messages=None, pdfs=()):
+        entry = {"seconds": round(seconds, 2), "recorded_at": time.time()}
+        if messages:
+            entry["messages"] = messages
+            span_days = self._span_days(chat)
+            if span_days:
+                entry["span_days"] = round(span_days, 2)
+        pdf_bytes = sum(os.path.getsize(pdf) for pdf in pdfs if os.path.exists(pdf))
+        if pdf_bytes:
+            entry["pdf_mb"] = round(pdf_bytes / 1024 / 1024, 3)
+        self.history[str(chat.id)] = entry
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.history, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not save job estimates to {self.path}: {e}[/yellow]")
+
+def format_duration(seconds):
+    seconds = int(max(0, seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+
+class EstimatedTimeColumn(ProgressColumn):
+    """
+    Shows the time left until a task's `finish_at` field (a time.monotonic() deadline), if it has one.
+    """
+
+    def render(self, task):
+        finish_at = task.fields.get("finish_at")
+        if finish_at is None:
+            return Text("")
+        return Text(f"ETA {format_duration(finish_at - time.monotonic())}", style="progress.remaining")
+
+async def run_archive_pipeline(chats, discord_token, save_directory, dce_cli_path, upload_channel=None,
+                               export_workers=None, render_workers=None, upload_workers=None, queue_size=None,
+                               journal=None):
+    """
+    Archives several channels/threads as a pipeline of export -> render -> upload stages.
+
+    Each stage has its own pool of workers connected by bounded queues, so channel N can
+    be uploading while N+1 renders and N+2 exports. When the render queue is full the
+    exporters wait, which caps how many HTML exports (and their media) sit on disk.
+    Uploading is skipped when `upload_channel` is None. With a `journal`, each finished stage is
+    recorded and stages the journal already records as done are skipped.
+
+    With SCHEDULE_ORDER=largest, chats start in order of estimated size, largest first, so the
+    longest jobs overlap with the rest instead of running alone at the end; the estimates also
+    drive the ETA shown in the progress display.
+
+    Returns one dict per chat, in the same order as `chats`, with the chat, its final status,
+    its PDFs and whether they were all uploaded. See pipeline_pdf_files for the flat lists.
+    """
+    export_workers = max(1, export_workers or EXPORT_WORKERS)
+    render_workers = max(1, render_workers or RENDER_WORKERS)
+    upload_workers = max(1, upload_workers or UPLOAD_WORKERS)
+    queue_size = max(1, queue_size or PIPELINE_QUEUE_SIZE)
+
+    pdf_results = [None] * len(chats)
+    statuses = ["Queued"] * len(chats)
+    uploaded = set()
+
+    estimator = JobEstimator(save_directory)
+    estimates = [estimator.estimate(chat)[0] for chat in chats]
+    work_seconds = [0.0] * len(chats)
+    finished = set()
+    order = list(range(len(chats)))
+    if SCHEDULE_ORDER == "largest":
+        # Longest-processing-time-first: workers pull from one queue, so this is greedy LPT scheduling.
+        order.sort(key=lambda index: estimates[index], reverse=True)
+
+    export_queue = asyncio.Queue()
+    for index in order:
+        export_queue.put_nowait((index, chats[index]))
+    render_queue = asyncio.Queue(maxsize=queue_size)
+    upload_queue = asyncio.Queue(maxsize=queue_size)
+
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), BarColumn(), MofNCompleteColumn(),
+                  EstimatedTimeColumn(), console=console) as progress:
+        overall_task = progress.add_task(f"[bold cyan]Archiving {len(chats)} chat(s)...", total=len(chats))
+        job_tasks = [None] * len(chats)
+        for index in order:
+            job_tasks[index] = progress.add_task(
+                f"[grey]{chat_display_name(chats[index])}: Queued (est. {format_duration(estimates[index])})[/grey]", total=1)
+
+        def update_eta():
+            # Remaining estimated work spread over the workers, scaled by how the estimates compared
+            # with reality so far, but never less than the largest remaining job.
+            remaining = [estimates[index] for index in range(len(chats)) if index not in finished]
+            measured = [index for index in finished if work_seconds[index] > 0]
+            estimated_total = sum(estimates[index] for index in measured)
+            calibration = sum(work_seconds[index] for index in measured) / estimated_total if estimated_total else 1.0
+            parallel = max(1, min(max(export_workers, render_workers), len(remaining)))
+            eta = max(sum(remaining) / parallel, max(remaining, default=0)) * calibration
+            progress.update(overall_task, finish_at=time.monotonic() + eta if remaining else None)
+
+        def set_status(index, status, style="cyan", done=False, completed=None):
+            statuses[index] = status
+            if completed is None:
+                completed = 1 if done else 0
+            progress.update(job_tasks[index], description=f"[{style}]{chat_display_name(chats[index])}: {status}[/{style}]", completed=completed)
+            if done:
+                progress.advance(overall_task)
+                finished.add(index)
+                update_eta()
+
+        update_eta()
+
+        async def deliver(index):
+            # Passes a finished chat on to the upload stage, or marks it done.
+            if journal and pdf_results[index]:
+                await journal.mark_rendered(chats[index], as_pdf_list(pdf_results[index]), "Done")
+            if not pdf_results[index]:
+                set_status(index, "Conversion failed", style="red", done=True)
+            elif upload_channel:
+                set_status(index, "Waiting to upload", style="grey")
+                await upload_queue.put((index, as_pdf_list(pdf_results[index])))
+            else:
+                set_status(index, "Done", style="green", done=True)
+
+        def fail(index, status, message):
+            # Marks a chat whose handling raised as failed, unless it already finished.
+            progress.console.print(f"[red]{message}[/red]")
+            if index not in finished:
+                set_status(index, status, style="red", done=True)
+
+        async def export_worker():
+            while True:
+                try:
+                    index, chat = export_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await export_one(index, chat)
+                except Exception as e:
+                    fail(index, "Export failed", f"Failed to export {chat_display_name(chat)}: {e}")
+
+        async def export_one(index, chat):
+            set_status(index, "Preparing")
+            job = None
+            html_file = None
+            try:
+                if journal:
+                    completed = await journal.completed_pdfs(chat)
+                    if completed:
+                        pdfs, status = completed
+                        pdf_results[index] = pdfs or None
+                        if not pdfs or not upload_channel or journal.stage_done(chat, "uploaded"):
+                            if journal.stage_done(chat, "uploaded"):
+                                uploaded.update(pdfs)
+                            set_status(index, f"{status} (journaled)", style="green", done=True)
+                            statuses[index] = status
+                        else:
+                            await deliver(index)
+                        return
+                    resumed_job = journal.exported_job(chat, save_directory)
+                    if resumed_job:
+                        media_cache = get_media_cache()
+                        if media_cache:
+                            media_cache.pin(resumed_job["html_file"])
+                        set_status(index, "Waiting to render (resumed)", style="grey")
+                        await render_queue.put((index, resumed_job))
+                        return
+                job = await prepare_export_job(chat, save_directory)
+                if job["up_to_date"]:
+                    pdf_results[index] = await finish_export_job(job, None)
+                    set_status(index, "Up to date", style="green", done=True)
+                    if journal:
+                        await journal.mark_rendered(chat, as_pdf_list(pdf_results[index]), "Up to date")
+                    return
+                parts = await plan_partitions(job)
+                if len(parts) > 1:
+                    # Large chat: export and render its partitions here, then hand the result to uploading.
+                    started = time.perf_counter()
+                    result = await archive_partitions(job, parts, discord_token, dce_cli_path,
+                                                      status_callback=lambda status, index=index: set_status(index, status))
+                    work_seconds[index] += time.perf_counter() - started
+                    if result and not job["after"]:
+                        estimator.record(chat, work_seconds[index], pdfs=as_pdf_list(result))
+                    pdf_results[index] = await finish_export_job(job, result)
+                    await deliver(index)
+                    return
+                set_status(index, "Exporting")
+                started = time.perf_counter()
+                html_file = await export_chat_html(
+                    job, discord_token, dce_cli_path,
+                    on_progress=lambda fraction, index=index: set_status(index, f"Exporting {fraction:.0%}", completed=fraction),
+                )
+                work_seconds[index] += time.perf_counter() - started
+            except Exception as e:
+                progress.console.print(f"[red]Failed to export {chat_display_name(chat)}: {e}[/red]")
+            if html_file:
+                if journal:
+                    journal.mark_exported(job)
+                set_status(index, "Waiting to render", style="grey")
+                await render_queue.put((index, job))
+            else:
+                if job:
+                    cleanup_export_files(job["html_file"])
+                set_status(index, "Export failed", style="red", done=True)
+
+        async def render_worker():
+            while True:
+                item = await render_queue.get()
+                if item is None:
+                    return
+                index, job = item
+                try:
+                    await render_one(index, job)
+                except Exception as e:
+                    fail(index, "Conversion failed", f"Failed to convert {job['name']}: {e}")
 
-async def archive_one_channel(chat_to_process, discord_token, save_directory, dce_cli_path):
-    """
-    Archives a single channel to a PDF and returns the file path.
-    """
-    channel_name_for_file = f"#{chat_to_process.name}" if not isinstance(chat_to_process, discord.DMChannel) else f"DM with {chat_to_process.recipient.name}"
-    console.print(Rule(f"[bold cyan]Processing: {channel_name_for_file} (ID: {chat_to_process.id})[/bold cyan]"))
+        async def render_one(index, job):
+            set_status(index, "Converting")
+            pdf_path = None
+            started = time.perf_counter()
+            try:
+                pdf_path = await render_html_to_pdf(job["html_file"], job["pdf_file"], job["name"],
+                                                    log_file=command_log_path(job, "render"))
+            except Exception as e:
+                progress.console.print(f"[red]Failed to convert {job['name']}: {e}[/red]")
+            finally:
+                cleanup_export_files(job["html_file"])
+            work_seconds[index] += time.perf_counter() - started
+            if pdf_path and "message_count" in job and not job["after"]:
+                # Only full exports made in this run say how long the whole chat takes.
+                estimator.record(chats[index], work_seconds[index], messages=job.get("message_count"), pdfs=[pdf_path])
+            pdf_results[index] = await finish_export_job(job, pdf_path)
+            await deliver(index)
 
-    sanitized_chat_name = sanitize_filename(channel_name_for_file)
-    
-    output_filename_base = f"discord_export_{sanitized_chat_name}_{chat_to_process.id}"
+        async def upload_worker():
+            while True:
+                item = await upload_queue.get()
+                if item is None:
+                    return
+                # Take whatever else is already waiting so several chats share messages.
+                items = [item]
+                stop = False
+                while sum(len(pdfs) for _, pdfs in items) < MAX_ATTACHMENTS_PER_MESSAGE:
+                    try:
+                        next_item = upload_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if next_item is None:
+                        stop = True
+                        break
+                    items.append(next_item)
 
-    html_file = os.path.join(save_directory, f"{output_filename_base}.html")
-    pdf_file = os.path.join(save_directory, f"{output_filename_base}.pdf")
+                for index, _ in items:
+                    set_status(index, "Uploading")
+                try:
+                    uploaded.update(await upload_pdfs(upload_channel, [pdf for _, pdfs in items for pdf in pdfs]))
+                except Exception as e:
+                    progress.console.print(f"[red]Upload failed: {e}[/red]")
+                for index, pdfs in items:
+                    try:
+                        if all(pdf in uploaded for pdf in pdfs):
+                            if journal:
+                                journal.mark_uploaded(chats[index])
+                            set_status(index, "Uploaded", style="green", done=True)
+                        else:
+                            set_status(index, "Upload failed", style="red", done=True)
+                    except Exception as e:
+                        fail(index, "Upload failed", f"Failed to record the upload of {chat_display_name(chats[index])}: {e}")
+                if stop:
+                    return
 
-    # --- Export Discord chat to HTML ---
-    console.print(Rule(f"[bold cyan]Exporting to HTML for {channel_name_for_file}[/bold cyan]"))
-    export_command = [dce_cli_path, "export", "-t", discord_token, "-c", str(chat_to_process.id), "-o", html_file, "--media", "--markdown"]
+        async def run_exporters():
+            await asyncio.gather(*(export_worker() for _ in range(export_workers)))
+            for _ in range(render_workers):
+                await render_queue.put(None)
 
-    if not run_command(export_command, f"DiscordChatExporter for {channel_name_for_file}"):
-        return None
-    if not os.path.exists(html_file):
-        return None
+        async def run_renderers():
+            await asyncio.gather(*(render_worker() for _ in range(render_workers)))
+            for _ in range(upload_workers if upload_channel else 0):
+                await upload_queue.put(None)
 
-    # --- Convert HTML to PDF ---
-    console.print(Rule(f"[bold cyan]Converting to PDF for {channel_name_for_file}[/bold cyan]"))
-    weasyprint_args = []
-    temp_css_file = None
-    try:
-        temp_css_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.css', encoding='utf-8')
-        temp_css_file.write("@page { margin: 0; }")
-        temp_css_file.close()
-        weasyprint_args.extend(["--stylesheet", temp_css_file.name])
-    except Exception as e:
-        console.print(f"[bold red]Error creating temporary stylesheet for margins: {e}[/bold red]")
+        async def run_uploaders():
+            await asyncio.gather(*(upload_worker() for _ in range(upload_workers if upload_channel else 0)))
 
-    convert_command = ["weasyprint", *weasyprint_args, "--encoding", "utf-8", html_file, pdf_file]
-    
-    pdf_path = None
-    if run_command(convert_command, f"WeasyPrint Conversion for {channel_name_for_file}"):
-        if os.path.exists(pdf_file):
-            pdf_path = pdf_file
+        # All stages run under one gather: if a stage dies, the others are cancelled instead of
+        # waiting forever on a queue nobody drains.
+        stages = [asyncio.create_task(stage()) for stage in (run_exporters, run_renderers, run_uploaders)]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
 
-    if temp_css_file and os.path.exists(temp_css_file.name):
-        os.remove(temp_css_file.name)
+    estimator.save()
+    print_media_cache_stats()
+    metrics.write_reports()
+    return [
+        {"chat": chat, "status": status, "pdfs": as_pdf_list(result),
+         "uploaded": bool(as_pdf_list(result)) and all(pdf in uploaded for pdf in as_pdf_list(result))}
+        for chat, status, result in zip(chats, statuses, pdf_results)
+    ]
 
-    # --- Cleanup ---
-    try:
-        if os.path.exists(html_file):
-            os.remove(html_file)
-        media_dir = os.path.join(save_directory, f"{os.path.splitext(os.path.basename(html_file))[0]}_attachments")
-        if os.path.isdir(media_dir):
-            shutil.rmtree(media_dir)
-    except OSError as e:
-        console.print(f"[bold red]Error during cleanup: {e}[/bold red]")
+def pipeline_pdf_files(chat_results):
+    """
+    Flattens run_archive_pipeline results into (generated_pdf_files, uploaded_pdf_files).
+    """
+    generated_pdf_files = [pdf for result in chat_results for pdf in result["pdfs"]]
+    uploaded_pdf_files = [pdf for result in chat_results if result["uploaded"] for pdf in result["pdfs"]]
+    return generated_pdf_files, uploaded_pdf_files
 
-    return pdf_path
+def resolve_upload_channel(chosen_guild):
+    """
+    Resolves the channel archived PDFs are uploaded to, honouring UPLOAD_SERVER_ID and UPLOAD_CHANNEL_ID.
+    Returns (upload_channel, upload_guild); upload_channel is None if it is missing or the bot cannot post files there.
+    """
+    upload_channel = None
+    upload_guild = chosen_guild
+    
+    upload_server_id_str = os.getenv('UPLOAD_SERVER_ID')
+    if upload_server_id_str:
+        try:
+            guild = bot.get_guild(int(upload_server_id_str))
+            if guild: upload_guild = guild
+            else: console.print(f"[yellow]Warning: Bot not in server with ID {upload_server_id_str}. Defaulting to current server.[/yellow]")
+        except ValueError:
+             console.print(f"[yellow]Warning: Invalid UPLOAD_SERVER_ID. Defaulting to current server.[/yellow]")
 
-async def run_standard_post_archive_flow(generated_pdf_files, chosen_guild, initial_selection):
+    upload_channel_id_str = os.getenv('UPLOAD_CHANNEL_ID')
+    if upload_channel_id_str:
+        try:
+            if upload_guild:
+                upload_channel = upload_guild.get_channel(int(upload_channel_id_str))
+        except ValueError:
+            console.print(f"[yellow]Warning: Invalid UPLOAD_CHANNEL_ID format.[/yellow]")
+    elif upload_guild:
+        upload_channel = discord.utils.get(upload_guild.text_channels, name='channel-archive')
+
+    if upload_channel and upload_channel.permissions_for(upload_guild.me).send_messages and upload_channel.permissions_for(upload_guild.me).attach_files:
+        return upload_channel, upload_guild
+    return None, upload_guild
+
+async def run_standard_post_archive_flow(generated_pdf_files, chosen_guild, initial_selection, already_uploaded=None, upload=None):
     """
     Runs the standard post-archive steps: Upload, DM, and Delete.
+    PDFs listed in `already_uploaded` (e.g. by the archive pipeline) are not uploaded again.
+    `upload` is the user's earlier answer to the upload question; None asks it here.
     """
     # --- Step 5: Optional PDF Upload ---
     console.print(Rule("[bold cyan]Step 5: PDF Upload[/bold cyan]"))
-    if generated_pdf_files:
-        upload_channel = None
-        upload_guild = chosen_guild
-        
-        upload_server_id_str = os.getenv('UPLOAD_SERVER_ID')
-        if upload_server_id_str:
-            try:
-                guild = bot.get_guild(int(upload_server_id_str))
-                if guild: upload_guild = guild
-                else: console.print(f"[yellow]Warning: Bot not in server with ID {upload_server_id_str}. Defaulting to current server.[/yellow]")
-            except ValueError:
-                 console.print(f"[yellow]Warning: Invalid UPLOAD_SERVER_ID. Defaulting to current server.[/yellow]")
-
-        upload_channel_id_str = os.getenv('UPLOAD_CHANNEL_ID')
-        if upload_channel_id_str:
-            try:
-                if upload_guild:
-                    upload_channel = upload_guild.get_channel(int(upload_channel_id_str))
-            except ValueError:
-                console.print(f"[yellow]Warning: Invalid UPLOAD_CHANNEL_ID format.[/yellow]")
-        elif upload_guild:
-            upload_channel = discord.utils.get(upload_guild.text_channels, name='channel-archive')
+    pdfs_to_upload = [pdf for pdf in generated_pdf_files if pdf not in (already_uploaded or [])]
+    if already_uploaded:
+        console.print(f"[green]{len(already_uploaded)} PDF(s) were already uploaded while archiving.[/green]")
+    if pdfs_to_upload:
+        upload_channel, upload_guild = resolve_upload_channel(chosen_guild)
 
-        if upload_channel and upload_channel.permissions_for(upload_guild.me).send_messages and upload_channel.permissions_for(upload_guild.me).attach_files:
+        if upload_channel:
             upload_prompt = Text(f"Upload the generated PDF(s) to #{upload_channel.name} in server {upload_guild.name}?", style=prompt_style)
-            if Confirm.ask(upload_prompt, default=True):
+            if upload is None:
+                upload = Confirm.ask(upload_prompt, default=True)
+            if upload:
                  with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), console=console) as progress:
-                    upload_task = progress.add_task("[cyan]Uploading PDFs...", total=len(generated_pdf_files))
-                    for pdf in generated_pdf_files:
-                        try:
-                            with open(pdf, 'rb') as f:
-                                await upload_channel.send(file=discord.File(f, filename=os.path.basename(pdf)))
-                        except Exception as e:
-                            progress.console.print(f"[red]Failed to upload {os.path.basename(pdf)}: {e}[/red]")
-                        progress.update(upload_task, advance=1)
+                    upload_task = progress.add_task("[cyan]Uploading PDFs...", total=len(pdfs_to_upload))
+                    uploaded = await upload_pdfs(upload_channel, pdfs_to_upload, on_uploaded=lambda pdf: progress.update(upload_task, advance=1))
+                    if len(uploaded) < len(pdfs_to_upload):
+                        progress.console.print(f"[red]{len(pdfs_to_upload) - len(uploaded)} PDF(s) could not be uploaded.[/red]")
         # ... error handling ...
 
     # --- Step 6: Optional DM to channel members ---
     console.print(Rule("[bold cyan]Step 6: Optional DM to Channel Members[/bold cyan]"))
     if generated_pdf_files and Confirm.ask(Text("DM the PDF(s) to other channel members?", style=prompt_style), default=False):
-        if hasattr(initial_selection, 'guild') and not initial_selection.guild.chunked: 
-            await initial_selection.guild.chunk()
+        if hasattr(initial_selection, 'guild'):
+            await ensure_guild_members([initial_selection.guild])
         
         members_in_channel = []
         if hasattr(initial_selection, 'members'):
@@ -225,28 +2646,7 @@ async def run_standard_post_archive_flow(generated_pdf_files, chosen_guild, init
                 selected_members_to_dm = [m for m in members_in_channel if str(m.id) in selected_member_ids]
 
                 with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), console=console) as progress:
-                    dm_task = progress.add_task("[cyan]Sending DMs...", total=len(selected_members_to_dm) * len(generated_pdf_files))
-                    for member in selected_members_to_dm:
-                        for pdf in generated_pdf_files:
-                            try:
-                                with open(pdf, 'rb') as f:
-                                    await member.send(file=discord.File(f, filename=os.path.basename(pdf)))
-                                
-                                dm_message = f"This is an archived copy of the Discord channel: "
-                                if initial_selection.guild:
-                                    dm_message += f"**Server:** {initial_selection.guild.name}, "
-                                
-                                if isinstance(initial_selection, discord.Thread):
-                                    dm_message += f"**Channel:** #{initial_selection.parent.name}, **Thread:** {initial_selection.name}"
-                                else:
-                                    dm_message += f"**Channel:** #{initial_selection.name}"
-                                dm_message += ".\n\nFor your records."
-                                
-                                await member.send(dm_message)
-                                progress.console.print(f"[green]DM sent to {member.display_name} for {os.path.basename(pdf)}[/green]")
-                            except Exception as e:
-                                progress.console.print(f"[red]Failed to send DM to {member.display_name} for {os.path.basename(pdf)}: {e}[/red]")
-                            progress.update(dm_task, advance=1)
+                    await fan_out_dms(selected_members_to_dm, generated_pdf_files, archive_notice(initial_selection), progress=progress)
                 break
         else:
             console.print("[yellow]No non-bot members found in this channel to DM.[/yellow]")
@@ -262,6 +2662,354 @@ async def run_standard_post_archive_flow(generated_pdf_files, chosen_guild, init
             except Exception as e:
                 console.print(f"[red]Failed to delete channel: {e}[/red]")
 
+# --- Member Search Index ---
+async def ensure_guild_members(guilds):
+    """
+    Fetches the member lists of the guilds that are not chunked yet, concurrently.
+    With STARTUP_MODE=lazy this is the only place members are fetched, so only the guilds
+    a flow actually touches are chunked.
+    """
+    unchunked = [guild for guild in guilds if not guild.chunked]
+    if not unchunked:
+        return
+    started = time.perf_counter()
+    results = await asyncio.gather(*(guild.chunk() for guild in unchunked), return_exceptions=True)
+    for guild, result in zip(unchunked, results):
+        if isinstance(result, Exception):
+            console.print(f"[yellow]Warning: Could not fetch members of {guild.name}: {result}[/yellow]")
+    metrics.add("chunk", time.perf_counter() - started, guilds=len(unchunked))
+    console.print(f"[grey]Fetched the members of {len(unchunked)} server(s) in {time.perf_counter() - started:.1f}s.[/grey]")
+
+class MemberIndex:
+    """
+    An in-memory index of guild members by name, display name and global name.
+
+    Names are indexed by trigram, so a search only verifies the members sharing every trigram of
+    the query instead of scanning everyone. Results are ranked exact match, then prefix, then
+    word prefix, then substring. The index is built once (chunking guilds concurrently) and kept
+    current by the member join/update/leave listeners below.
+    """
+
+    def __init__(self):
+        self.members = {}   # user id -> {guild id: member}
+        self.keys = {}      # user id -> set of lowercase names
+        self.trigrams = {}  # trigram -> set of user ids
+        self.ready = False
+
+    @staticmethod
+    def _names(member):
+        return {name.lower() for name in (member.name, member.display_name, getattr(member, 'global_name', None)) if name}
+
+    @staticmethod
+    def _trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _reindex(self, user_id):
+        for key in self.keys.pop(user_id, set()):
+            for trigram in self._trigrams(key):
+                ids = self.trigrams.get(trigram)
+                if ids:
+                    ids.discard(user_id)
+                    if not ids:
+                        del self.trigrams[trigram]
+        memberships = self.members.get(user_id)
+        if not memberships:
+            self.members.pop(user_id, None)
+            return
+        keys = set().union(*(self._names(member) for member in memberships.values()))
+        self.keys[user_id] = keys
+        for key in keys:
+            for trigram in self._trigrams(key):
+                self.trigrams.setdefault(trigram, set()).add(user_id)
+
+    def add(self, member):
+        self.members.setdefault(member.id, {})[member.guild.id] = member
+        self._reindex(member.id)
+
+    def remove(self, member):
+        memberships = self.members.get(member.id)
+        if memberships:
+            memberships.pop(member.guild.id, None)
+            self._reindex(member.id)
+
+    async def build(self, guilds):
+        """
+        Chunks every guild that is not chunked yet, concurrently, then indexes all members.
+        """
+        await ensure_guild_members(guilds)
+        for guild in guilds:
+            for member in guild.members:
+                self.members.setdefault(member.id, {})[guild.id] = member
+        for user_id in list(self.members):
+            self._reindex(user_id)
+        self.ready = True
+
+    @staticmethod
+    def _rank(query, key):
+        if key == query:
+            return 0
+        if key.startswith(query):
+            return 1
+        if any(part.startswith(query) for part in re.split(r'[\s_.\-]+', key)[1:]):
+            return 2
+        return 3
+
+    def search(self, query, limit=None):
+        """
+        Returns members whose name, display name or global name contains `query`, best matches first.
+        """
+        query = query.lower()
+        if not query:
+            return []
+        if len(query) >= 3:
+            trigram_sets = sorted((self.trigrams.get(t, set()) for t in self._trigrams(query)), key=len)
+            candidates = set(trigram_sets[0]).intersection(*trigram_sets[1:]) if trigram_sets else set()
+        else:
+            candidates = self.keys.keys()
+
+        ranked = []
+        for user_id in candidates:
+            matches = [(self._rank(query, key), len(key)) for key in self.keys.get(user_id, ()) if query in key]
+            if matches:
+                member = next(iter(self.members[user_id].values()))
+                ranked.append((min(matches), member.name.lower(), member))
+        ranked.sort(key=lambda entry: (entry[0], entry[1]))
+        results = [member for _, _, member in ranked]
+        return results[:limit] if limit else results
+
+member_index = MemberIndex()
+
+@bot.listen()
+async def on_member_join(member):
+    if member_index.ready:
+        member_index.add(member)
+
+@bot.listen()
+async def on_member_update(before, after):
+    if member_index.ready:
+        member_index.add(after)
+
+@bot.listen()
+async def on_member_remove(member):
+    if member_index.ready:
+        member_index.remove(member)
+
+@bot.listen()
+async def on_user_update(before, after):
+    # Username or global name changes apply to every guild membership of the user.
+    if member_index.ready and after.id in member_index.members:
+        for guild_id in list(member_index.members[after.id]):
+            guild = bot.get_guild(guild_id)
+            member = guild.get_member(after.id) if guild else None
+            if member:
+                member_index.members[after.id][guild_id] = member
+        member_index._reindex(after.id)
+
+# --- Permission Cache ---
+def channel_sort_key(channel):
+    return (
+        (channel.category.position if hasattr(channel, 'category') and channel.category else float('inf')),
+        channel.position if hasattr(channel, 'position') else float('inf')
+    )
+
+class PermissionCache:
+    """
+    Caches read access per (guild, channel, member) and each guild's sorted list of channels and
+    threads the bot can read, so mutual-channel and channel-list queries skip permissions_for.
+
+    Entries are dropped by the listeners below: role and channel changes invalidate the whole
+    guild, member updates invalidate that member (or the guild when it is the bot itself), and
+    thread changes invalidate the guild's channel list and the thread's entries.
+    """
+
+    def __init__(self):
+        self._can_read = {}   # guild id -> {(channel id, member id): bool}
+        self._readable = {}   # guild id -> sorted channels/threads readable by the bot
+
+    def can_read(self, channel, member):
+        guild_cache = self._can_read.setdefault(channel.guild.id, {})
+        key = (channel.id, member.id)
+        if key not in guild_cache:
+            guild_cache[key] = channel.permissions_for(member).read_messages
+        return guild_cache[key]
+
+    def readable_channels(self, guild):
+        """
+        Returns the text channels and threads of `guild` the bot can read, in category/position order.
+        """
+        if guild.id not in self._readable:
+            channels = [ch for ch in guild.text_channels if self.can_read(ch, guild.me)]
+            channels += [th for th in guild.threads if self.can_read(th, guild.me)]
+            self._readable[guild.id] = sorted(channels, key=channel_sort_key)
+        return self._readable[guild.id]
+
+    def mutual_channels(self, guild, member):
+        """
+        Returns the channels and threads of `guild` readable by both the bot and `member`.
+        """
+        return [channel for channel in self.readable_channels(guild) if self.can_read(channel, member)]
+
+    def readable_forums(self, guild):
+        """
+        Returns the forum channels of `guild` the bot can read. Forums hold only threads (posts), so
+        they are listed for thread discovery but not as chats of their own.
+        """
+        return [forum for forum in getattr(guild, 'forums', []) if self.can_read(forum, guild.me)]
+
+    def invalidate_guild(self, guild_id):
+        self._can_read.pop(guild_id, None)
+        self._readable.pop(guild_id, None)
+
+    def invalidate_channel(self, guild_id, channel_id):
+        guild_cache = self._can_read.get(guild_id, {})
+        for key in [key for key in guild_cache if key[0] == channel_id]:
+            del guild_cache[key]
+        self._readable.pop(guild_id, None)
+
+    def invalidate_member(self, guild_id, member_id):
+        guild_cache = self._can_read.get(guild_id, {})
+        for key in [key for key in guild_cache if key[1] == member_id]:
+            del guild_cache[key]
+
+permission_cache = PermissionCache()
+
+@bot.listen()
+async def on_guild_role_create(role):
+    permission_cache.invalidate_guild(role.guild.id)
+
+@bot.listen()
+async def on_guild_role_update(before, after):
+    permission_cache.invalidate_guild(after.guild.id)
+
+@bot.listen()
+async def on_guild_role_delete(role):
+    permission_cache.invalidate_guild(role.guild.id)
+
+@bot.listen()
+async def on_guild_channel_create(channel):
+    permission_cache.invalidate_guild(channel.guild.id)
+
+@bot.listen()
+async def on_guild_channel_update(before, after):
+    # Overwrites on a category also change its synced children, so drop the whole guild.
+    permission_cache.invalidate_guild(after.guild.id)
+
+@bot.listen()
+async def on_guild_channel_delete(channel):
+    permission_cache.invalidate_guild(channel.guild.id)
+
+@bot.listen()
+async def on_thread_create(thread):
+    permission_cache.invalidate_channel(thread.guild.id, thread.id)
+    thread_discovery.invalidate(thread.guild.id, thread.parent_id)
+
+@bot.listen()
+async def on_thread_update(before, after):
+    permission_cache.invalidate_channel(after.guild.id, after.id)
+    thread_discovery.invalidate(after.guild.id, after.parent_id)
+
+@bot.listen()
+async def on_thread_delete(thread):
+    permission_cache.invalidate_channel(thread.guild.id, thread.id)
+    thread_discovery.invalidate(thread.guild.id, thread.parent_id)
+
+@bot.listen()
+async def on_thread_member_join(thread_member):
+    permission_cache.invalidate_channel(thread_member.thread.guild.id, thread_member.thread.id)
+
+@bot.listen()
+async def on_thread_member_remove(thread_member):
+    permission_cache.invalidate_channel(thread_member.thread.guild.id, thread_member.thread.id)
+
+@bot.listen('on_member_update')
+async def invalidate_permissions_on_member_update(before, after):
+    if before.roles == after.roles and before.pending == after.pending:
+        return
+    if bot.user and after.id == bot.user.id:
+        permission_cache.invalidate_guild(after.guild.id)
+    else:
+        permission_cache.invalidate_member(after.guild.id, after.id)
+
+@bot.listen('on_member_remove')
+async def invalidate_permissions_on_member_remove(member):
+    permission_cache.invalidate_member(member.guild.id, member.id)
+
+# --- Archived Thread Discovery ---
+class ThreadDiscovery:
+    """
+    Finds active and archived (public, and private where permitted) threads of parent channels.
+
+    Archived threads are only available by paging the API, one page after another per listing,
+    so listings for different parents (and the public/private listings of one parent) run
+    concurrently, THREAD_DISCOVERY_CONCURRENCY at a time. Results are cached per guild and
+    parent channel for THREAD_CACHE_TTL seconds.
+    """
+
+    def __init__(self, concurrency=THREAD_DISCOVERY_CONCURRENCY, ttl=THREAD_CACHE_TTL):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self._cache = {}  # guild id -> {parent id: (fetched at, [threads])}
+        self._semaphore = None
+
+    async def _list_archived(self, parent, private):
+        async with self._semaphore:
+            try:
+                if not private:
+                    return [thread async for thread in parent.archived_threads(limit=None)]
+                return [thread async for thread in parent.archived_threads(limit=None, private=True)]
+            except discord.Forbidden:
+                if private:
+                    # Without Manage Threads, private archived threads the bot has joined are still listable.
+                    try:
+                        return [thread async for thread in parent.archived_threads(limit=None, private=True, joined=True)]
+                    except discord.HTTPException:
+                        return []
+                return []
+            except discord.HTTPException as e:
+                console.print(f"[yellow]Warning: Could not list archived threads of #{parent.name}: {e}[/yellow]")
+                return []
+
+    async def _discover_parent(self, parent):
+        me = parent.guild.me
+        listings = [self._list_archived(parent, private=False)]
+        # Forum posts are always public threads.
+        if isinstance(parent, discord.TextChannel) and parent.permissions_for(me).read_message_history:
+            listings.append(self._list_archived(parent, private=True))
+        threads = {thread.id: thread for thread in parent.threads}
+        for archived in await asyncio.gather(*listings):
+            for thread in archived:
+                threads.setdefault(thread.id, thread)
+        return sorted(threads.values(), key=lambda thread: thread.id)
+
+    async def threads_for(self, parents, refresh=False):
+        """
+        Returns {parent id: [threads]} for `parents`, fetching uncached or expired entries concurrently.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        now = time.monotonic()
+        results = {}
+        stale = []
+        for parent in parents:
+            cached = self._cache.get(parent.guild.id, {}).get(parent.id)
+            if cached and not refresh and now - cached[0] < self.ttl:
+                results[parent.id] = cached[1]
+            else:
+                stale.append(parent)
+        fetched = await asyncio.gather(*(self._discover_parent(parent) for parent in stale))
+        for parent, threads in zip(stale, fetched):
+            self._cache.setdefault(parent.guild.id, {})[parent.id] = (time.monotonic(), threads)
+            results[parent.id] = threads
+        return results
+
+    def invalidate(self, guild_id, parent_id=None):
+        if parent_id is None:
+            self._cache.pop(guild_id, None)
+        else:
+            self._cache.get(guild_id, {}).pop(parent_id, None)
+
+thread_discovery = ThreadDiscovery()
+
 async def run_user_search_flow():
     """
     Handles the workflow for finding channels by searching for a user.
@@ -276,17 +3024,13 @@ async def run_user_search_flow():
         if search_query == 'q': return True
         if not search_query: continue
 
-        if not any(g.chunked for g in bot.guilds):
-             with Progress(SpinnerColumn(), TextColumn("[cyan]Fetching server members..."), console=console) as progress:
-                for guild in bot.guilds: await guild.chunk()
+        if not member_index.ready:
+            with Progress(SpinnerColumn(), TextColumn("[cyan]Fetching server members..."), console=console) as progress:
+                await member_index.build(bot.guilds)
 
-        found_users_map = {}
-        for member in bot.get_all_members():
-             if search_query in member.name.lower() or search_query in member.display_name.lower() or (member.global_name and search_query in member.global_name.lower()):
-                if member.id not in found_users_map:
-                    found_users_map[member.id] = member
-
-        found_users = list(found_users_map.values())
+        search_started = time.perf_counter()
+        found_users = member_index.search(search_query)
+        console.print(f"[grey]Found {len(found_users)} user(s) in {(time.perf_counter() - search_started) * 1000:.1f} ms.[/grey]")
 
         if not found_users:
             console.print(f"[yellow]No users found matching '{search_query}'.[/yellow]")
@@ -319,18 +3063,10 @@ async def run_user_search_flow():
         member = guild.get_member(target_user.id)
         if not member: continue
         
-        guild_channels = []
-        for channel in guild.text_channels:
-            if channel.permissions_for(member).read_messages and channel.permissions_for(guild.me).read_messages:
-                guild_channels.append(channel)
-        for thread in guild.threads:
-            if thread.permissions_for(member).read_messages and thread.permissions_for(guild.me).read_messages:
-                guild_channels.append(thread)
+        guild_channels = permission_cache.mutual_channels(guild, member)
         
         if guild_channels:
             guild_node = tree.add(f"[bold blue]Server: {guild.name}[/bold blue]")
-            
-            guild_channels.sort(key=lambda c: (c.category.position if hasattr(c, 'category') and c.category else float('inf'), c.position if hasattr(c, 'position') else float('inf')))
 
             last_category_id = object()
             category_node = None
@@ -383,24 +3119,24 @@ async def run_user_search_flow():
         return True
 
     # --- Perform Actions ---
-    pdf_file_path = None
+    pdf_files = []
     
     # Archive if needed
     if action_choice in ["2", "3", "4"]:
         current_discord_token = bot.http.token
         dce_cli_path = os.getenv('DCE_CLI_PATH') or shutil.which("DiscordChatExporter.Cli")
         save_directory = os.getenv('SAVE_DIRECTORY', ".")
-        pdf_file_path = await archive_one_channel(initial_selection, current_discord_token, save_directory, dce_cli_path)
-        if not pdf_file_path:
+        pdf_files = as_pdf_list(await archive_one_channel_with_progress(initial_selection, current_discord_token, save_directory, dce_cli_path))
+        if not pdf_files:
             console.print("[bold red]Archiving failed. Aborting further actions.[/bold red]")
             return True
 
     # DM if needed
-    if action_choice in ["2", "3"] and pdf_file_path:
+    if action_choice in ["2", "3"] and pdf_files:
         console.print(f"[cyan]Sending PDF to {target_member.display_name}...[/cyan]")
         try:
-            with open(pdf_file_path, 'rb') as f:
-                await target_member.send(file=discord.File(f, filename=os.path.basename(pdf_file_path)))
+            for pdf_file_path in pdf_files:
+                await send_file(target_member, pdf_file_path)
             console.print("[green]DM sent successfully.[/green]")
         except Exception as e:
             console.print(f"[red]Failed to send DM: {e}[/red]")
@@ -422,15 +3158,15 @@ async def run_user_search_flow():
 
                 # Notify if needed
                 if action_choice in ["3", "4"]:
-                    await initial_selection.send(f":wave: {target_member.mention} has been removed from this channel. An archive of the conversation has been processed.")
+                    await send_message(initial_selection, f":wave: {target_member.mention} has been removed from this channel. An archive of the conversation has been processed.")
             except Exception as e:
                 console.print(f"[red]Failed to remove user or post notice: {e}[/red]")
         else:
             console.print(f"[yellow]Warning: Bot lacks permissions to remove users from {initial_selection.name}.[/yellow]")
 
     # Upload to archive channel if needed
-    if action_choice == "4" and pdf_file_path:
-        await run_standard_post_archive_flow([pdf_file_path], initial_selection.guild, initial_selection)
+    if action_choice == "4" and pdf_files:
+        await run_standard_post_archive_flow(pdf_files, initial_selection.guild, initial_selection)
 
     return True
 
@@ -459,12 +3195,7 @@ async def run_server_channel_flow_complete():
     chats_to_export = []
     
     full_readable_channels_for_selection = sorted(
-        [ch for ch in chosen_guild.text_channels if ch.permissions_for(chosen_guild.me).read_messages] +
-        [th for th in chosen_guild.threads if th.permissions_for(chosen_guild.me).read_messages],
-        key=lambda x: (
-            (x.category.position if hasattr(x, 'category') and x.category else float('inf')),
-            x.position if hasattr(x, 'position') else float('inf')
-        ))
+        permission_cache.readable_channels(chosen_guild) + permission_cache.readable_forums(chosen_guild), key=channel_sort_key)
 
     if not full_readable_channels_for_selection:
         console.print(f"[bold red]No readable text channels or threads found in '[bold]{chosen_guild.name}[/bold]'.[/bold red]", style="red")
@@ -515,9 +3246,18 @@ async def run_server_channel_flow_complete():
     if not choice_str: return True
     initial_selection = filtered_channels[int(choice_str) - 1]
     
-    if isinstance(initial_selection, discord.TextChannel):
-        chats_to_export.append(initial_selection)
-        chats_to_export.extend([t for t in initial_selection.threads if t.permissions_for(chosen_guild.me).read_messages])
+    if is_thread_parent(initial_selection):
+        if isinstance(initial_selection, discord.TextChannel):
+            chats_to_export.append(initial_selection)
+        with Progress(SpinnerColumn(), TextColumn("[cyan]Discovering active and archived threads..."), console=console):
+            threads = (await thread_discovery.threads_for([initial_selection]))[initial_selection.id]
+        readable_threads = [thread for thread in threads if permission_cache.can_read(thread, chosen_guild.me)]
+        archived_count = sum(1 for thread in readable_threads if thread.archived)
+        console.print(f"[cyan]Found {len(readable_threads)} readable thread(s) in #{initial_selection.name} ({archived_count} archived).[/cyan]")
+        chats_to_export.extend(readable_threads)
+        if not chats_to_export:
+            console.print(f"[yellow]The forum #{initial_selection.name} has no readable posts to archive.[/yellow]")
+            return True
     else:
         chats_to_export.append(initial_selection)
 
@@ -525,15 +3265,722 @@ async def run_server_channel_flow_complete():
     dce_cli_path = os.getenv('DCE_CLI_PATH') or shutil.which("DiscordChatExporter.Cli")
     save_directory = os.getenv('SAVE_DIRECTORY', ".")
 
-    for chat in chats_to_export:
-        pdf_path = await archive_one_channel(chat, current_discord_token, save_directory, dce_cli_path)
-        if pdf_path:
-            generated_pdf_files.append(pdf_path)
+    uploaded_pdf_files = []
+    upload = None  # The user's answer to uploading, once asked.
+
+    if len(chats_to_export) > 1:
+        # Several chats: upload each PDF as soon as it is rendered instead of after the whole batch.
+        upload_channel, upload_guild = resolve_upload_channel(chosen_guild)
+        if upload_channel:
+            upload_prompt = Text(f"Upload each PDF to #{upload_channel.name} in server {upload_guild.name} as soon as it is ready?", style=prompt_style)
+            upload = Confirm.ask(upload_prompt, default=True)
+            if not upload:
+                upload_channel = None
+        # Journal the run as an equivalent batch job so 'archive.py resume' can finish it after a crash.
+        journal = ArchiveJournal.start(save_directory, {
+            "guilds": [], "channels": [initial_selection.id], "channel_filter": None, "include_threads": True,
+            "upload": upload_channel is not None, "dm_members": False, "delete": False, "summary": None,
+        })
+        chat_results = await run_archive_pipeline(
+            chats_to_export, current_discord_token, save_directory, dce_cli_path, upload_channel=upload_channel, journal=journal)
+        journal.finish(complete=all(result["pdfs"] or result["status"] == "Up to date" for result in chat_results))
+        generated_pdf_files, uploaded_pdf_files = pipeline_pdf_files(chat_results)
+    else:
+        for chat in chats_to_export:
+            pdf_path = await archive_one_channel_with_progress(chat, current_discord_token, save_directory, dce_cli_path)
+            generated_pdf_files.extend(as_pdf_list(pdf_path))
     
-    await run_standard_post_archive_flow(generated_pdf_files, chosen_guild, initial_selection)
+    await run_standard_post_archive_flow(generated_pdf_files, chosen_guild, initial_selection, already_uploaded=uploaded_pdf_files, upload=upload)
 
     return True
 
+# --- Crash-Safe Job Journal ---
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ArchiveJournal:
+    """
+    A durable record of how far each chat of a run has got: exported, rendered, uploaded and
+    DMed, with SHA-256 checksums of the rendered PDFs. Every update rewrites the journal
+    atomically (temp file + os.replace), so a crash never leaves it half-written. The resume
+    command re-runs the journal's job and skips every stage that is recorded as done and whose
+    output is still on disk and unchanged.
+    """
+
+    # Export job fields needed to render an already exported HTML file after a restart.
+    JOB_FIELDS = ("html_file", "pdf_file", "after", "before", "high_water", "previous_pdf", "up_to_date")
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def start(cls, save_directory, job_spec):
+        """
+        Starts a new journal for `job_spec` (a batch job dict). Every run gets its own journal file,
+        so concurrent runs in one save directory never touch each other's journals. Journals of
+        earlier runs that completed are removed; unfinished ones are kept for resume.
+        """
+        for path in glob.glob(os.path.join(save_directory, ARCHIVE_JOURNAL_PATTERN)):
+            try:
+                if cls.load(path).data.get("status") == "complete":
+                    os.remove(path)
+            except (OSError, ValueError):
+                pass
+        now = time.time()
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{os.getpid()}-{os.urandom(2).hex()}"
+        journal = cls(os.path.join(save_directory, ARCHIVE_JOURNAL_FILE.format(run_id=run_id)),
+                      {"version": 1, "status": "running", "job": job_spec, "created_at": now, "updated_at": now, "chats": {}})
+        journal.claim()
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(path, json.load(f))
+
+    @classmethod
+    def find_resumable(cls, save_directory):
+        """
+        Returns the most recently started journal in `save_directory` whose run did not complete
+        and is not still running, or None.
+        """
+        candidates = []
+        for path in glob.glob(os.path.join(save_directory, ARCHIVE_JOURNAL_PATTERN)):
+            try:
+                journal = cls.load(path)
+            except (OSError, ValueError):
+                continue
+            status = journal.data.get("status")
+            if status == "incomplete" or (status == "running" and not journal.owner_alive()):
+                candidates.append(journal)
+        return max(candidates, key=lambda journal: journal.data.get("created_at", 0), default=None)
+
+    def owner_alive(self):
+        """
+        Returns True if the process that last ran this journal may still be running. Processes on
+        other hosts cannot be checked and are assumed alive.
+        """
+        if self.data.get("host") != socket.gethostname():
+            return bool(self.data.get("host"))
+        try:
+            os.kill(self.data.get("pid", 0), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, OSError):
+            return True
+        return bool(self.data.get("pid"))
+
+    def claim(self):
+        """
+        Marks this process as the one running the journal's job.
+        """
+        self.data.update({"status": "running", "host": socket.gethostname(), "pid": os.getpid()})
+        self.save()
+
+    def save(self):
+        """
+        Atomically rewrites the journal. Failures (e.g. a full disk) only warn: the run itself goes on.
+        """
+        self.data["updated_at"] = time.time()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not update the journal {self.path}: {e}[/yellow]")
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _entry(self, chat):
+        entry = self.data["chats"].setdefault(str(chat.id), {"name": chat_display_name(chat), "stages": {}, "dm": {}})
+        return entry
+
+    def stage_done(self, chat, stage):
+        return stage in self.data["chats"].get(str(chat.id), {}).get("stages", {})
+
+    def mark_exported(self, job):
+        entry = self._entry(job["chat"])
+        entry["job"] = {field: job[field] for field in self.JOB_FIELDS}
+        entry["stages"]["exported"] = time.time()
+        self.save()
+
+    async def mark_rendered(self, chat, pdfs, status):
+        loop = asyncio.get_running_loop()
+        checksums = await asyncio.gather(*(loop.run_in_executor(None, file_sha256, pdf) for pdf in pdfs))
+        entry = self._entry(chat)
+        entry["pdfs"] = [{"path": pdf, "sha256": checksum} for pdf, checksum in zip(pdfs, checksums)]
+        entry["status"] = status
+        entry["stages"]["rendered"] = time.time()
+        self.save()
+
+    def mark_uploaded(self, chat):
+        self._entry(chat)["stages"]["uploaded"] = time.time()
+        self.save()
+
+    def mark_dm(self, chat, member_id):
+        self._entry(chat)["dm"][str(member_id)] = time.time()
+        self.save()
+
+    def dm_done(self, chat, member_id):
+        return str(member_id) in self.data["chats"].get(str(chat.id), {}).get("dm", {})
+
+    async def completed_pdfs(self, chat):
+        """
+        Returns (pdfs, status) if the chat was rendered and its PDFs still match their checksums, else None.
+        """
+        entry = self.data["chats"].get(str(chat.id))
+        if not entry or "rendered" not in entry["stages"]:
+            return None
+        loop = asyncio.get_running_loop()
+        for pdf in entry.get("pdfs", []):
+            if not os.path.exists(pdf["path"]) or await loop.run_in_executor(None, file_sha256, pdf["path"]) != pdf["sha256"]:
+                console.print(f"[yellow]{os.path.basename(pdf['path'])} is missing or changed since it was journaled; archiving {entry['name']} again.[/yellow]")
+                return None
+        return [pdf["path"] for pdf in entry.get("pdfs", [])], entry.get("status", "Done")
+
+    def exported_job(self, chat, save_directory):
+        """
+        Returns the export job of a chat that was exported but not rendered, if its HTML is still on disk.
+        """
+        entry = self.data["chats"].get(str(chat.id))
+        if not entry or "exported" not in entry["stages"] or "job" not in entry:
+            return None
+        if not os.path.exists(entry["job"]["html_file"]):
+            return None
+        job = {"chat": chat, "name": chat_display_name(chat), "save_directory": save_directory}
+        job.update(entry["job"])
+        return job
+
+    def finish(self, complete):
+        self.data["status"] = "complete" if complete else "incomplete"
+        self.save()
+
+# --- Headless Batch Mode ---
+# Set from the command line; when present, on_ready runs this job instead of the interactive menu.
+headless_job = None
+resume_journal = None
+queue_command = None
+exit_code = 0
+
+def load_job_spec(args):
+    """
+    Builds a batch job from an optional JSON job file, overridden by command-line arguments.
+    """
+    job = {
+        "guilds": [], "channels": [], "channel_filter": None, "include_threads": True,
+        "upload": False, "dm_members": False, "delete": False, "summary": None,
+    }
+    if args.job:
+        with open(args.job, 'r', encoding='utf-8') as f:
+            job.update(json.load(f))
+    if args.guild:
+        job["guilds"] = args.guild
+    if args.channel:
+        job["channels"] = args.channel
+    if args.filter is not None:
+        job["channel_filter"] = args.filter
+    for key in ("include_threads", "upload", "dm_members", "delete"):
+        value = getattr(args, key)
+        if value is not None:
+            job[key] = value
+    if args.summary:
+        job["summary"] = args.summary
+    job["guilds"] = [int(guild_id) for guild_id in job["guilds"]]
+    job["channels"] = [int(channel_id) for channel_id in job["channels"]]
+    if not job["guilds"] and not job["channels"]:
+        raise ValueError("the job must name at least one guild or channel")
+    return job
+
+async def resolve_job_chats(job, skipped=None):
+    """
+    Returns {guild: [(top-level chat, [chats to export])]} for a batch job.
+    Guild entries archive every readable text channel and forum; channel entries archive just that
+    channel, forum or thread. A forum's chats are its posts, so its list is empty without threads.
+    Channels that cannot be archived are appended to `skipped` as dicts with a reason.
+    """
+    name_filter = re.compile(job["channel_filter"], re.IGNORECASE) if job["channel_filter"] else None
+    selected = {}
+
+    def skip(guild_id, channel_id, name, reason):
+        console.print(f"[yellow]Skipping {name or channel_id}: {reason}.[/yellow]")
+        if skipped is not None:
+            skipped.append({"guild_id": guild_id, "channel_id": channel_id, "name": name, "reason": reason})
+
+    def add(guild, chat):
+        if name_filter and not name_filter.search(chat.name):
+            return
+        entries = selected.setdefault(guild, [])
+        if all(existing.id != chat.id for existing, _ in entries):
+            is_forum = is_thread_parent(chat) and not isinstance(chat, discord.TextChannel)
+            entries.append((chat, [] if is_forum else [chat]))
+
+    for guild_id in job["guilds"]:
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            skip(guild_id, None, f"server {guild_id}", "the bot is not in this server")
+            continue
+        for channel in permission_cache.readable_channels(guild) + permission_cache.readable_forums(guild):
+            if is_thread_parent(channel):
+                add(guild, channel)
+        for channel in guild.channels:
+            if isinstance(channel, discord.CategoryChannel) or (name_filter and not name_filter.search(channel.name)):
+                continue
+            if not permission_cache.can_read(channel, guild.me):
+                skip(guild.id, channel.id, channel.name, "the bot cannot read it")
+            elif not is_thread_parent(channel):
+                skip(guild.id, channel.id, channel.name, f"{channel.type} channels are not archived")
+
+    for channel_id in job["channels"]:
+        chat = bot.get_channel(channel_id)
+        if chat is None:
+            try:
+                chat = await bot.fetch_channel(channel_id)
+            except discord.HTTPException as e:
+                skip(None, channel_id, None, f"could not be fetched ({e})")
+                continue
+        if not (is_thread_parent(chat) or isinstance(chat, discord.Thread)):
+            skip(getattr(getattr(chat, 'guild', None), 'id', None), channel_id, getattr(chat, 'name', None), "not a text channel, forum or thread")
+            continue
+        add(chat.guild, chat)
+
+    if job["include_threads"]:
+        for guild, entries in selected.items():
+            parents = [chat for chat, _ in entries if is_thread_parent(chat)]
+            by_parent = await thread_discovery.threads_for(parents)
+            for chat, chats in entries:
+                chats.extend(thread for thread in by_parent.get(chat.id, []) if permission_cache.can_read(thread, guild.me))
+    for guild, entries in selected.items():
+        for chat, chats in list(entries):
+            if not chats:
+                entries.remove((chat, chats))
+                skip(guild.id, chat.id, chat.name, "forum without readable posts" if job["include_threads"]
+                     else "forum posts are threads and threads are not included")
+    return {guild: entries for guild, entries in selected.items() if entries}
+
+async def run_headless_job(job, journal=None):
+    """
+    Archives everything a batch job selects without prompting, applies its upload/DM/delete
+    policies and returns a machine-readable summary. Progress is recorded in `journal`.
+    """
+    started = time.time()
+    discord_token = bot.http.token
+    dce_cli_path = os.getenv('DCE_CLI_PATH') or shutil.which("DiscordChatExporter.Cli")
+    save_directory = os.getenv('SAVE_DIRECTORY', ".")
+    summary = {"started_at": started, "chats": [], "forums": [], "skipped": []}
+
+    selected = await resolve_job_chats(job, skipped=summary["skipped"])
+    for guild, entries in selected.items():
+        console.print(Rule(f"[bold cyan]Archiving {sum(len(chats) for _, chats in entries)} chat(s) in {guild.name}[/bold cyan]"))
+        upload_channel = resolve_upload_channel(guild)[0] if job["upload"] else None
+        if job["upload"] and not upload_channel:
+            console.print(f"[yellow]Warning: No usable upload channel for {guild.name}; PDFs will not be uploaded.[/yellow]")
+
+        all_chats = [chat for _, chats in entries for chat in chats]
+        chat_results = await run_archive_pipeline(all_chats, discord_token, save_directory, dce_cli_path,
+                                                  upload_channel=upload_channel, journal=journal)
+        result_by_id = {result["chat"].id: result for result in chat_results}
+
+        for top_chat, chats in entries:
+            results = [result_by_id[chat.id] for chat in chats]
+            # Up-to-date chats return their previous PDF, which members were already sent.
+            pdfs = [pdf for result in results if result["status"] != "Up to date" for pdf in result["pdfs"]]
+            archived = all(result["pdfs"] or result["status"] == "Up to date" for result in results)
+            dm_results = {}
+            if job["dm_members"] and pdfs and hasattr(top_chat, 'members'):
+                await ensure_guild_members([top_chat.guild])
+                members = [member for member in top_chat.members if not member.bot]
+                if journal:
+                    members = [member for member in members if not journal.dm_done(top_chat, member.id)]
+                dm_results = await fan_out_dms(members, pdfs, archive_notice(top_chat))
+                if journal:
+                    for member_id, error in dm_results.items():
+                        if error is None:
+                            journal.mark_dm(top_chat, member_id)
+            deleted = False
+            # Only channels named explicitly in the job are ever deleted, never whole guilds.
+            if (job["delete"] and archived and top_chat.id in job["channels"]
+                    and (not job["upload"] or all(result["uploaded"] for result in results if result["pdfs"]))
+                    and top_chat.permissions_for(guild.me).manage_channels):
+                try:
+                    await top_chat.delete()
+                    deleted = True
+                except discord.HTTPException as e:
+                    console.print(f"[red]Failed to delete #{top_chat.name}: {e}[/red]")
+            dm_summary = {str(member_id): (str(error) if error else "sent") for member_id, error in dm_results.items()}
+            if top_chat not in chats:
+                summary["forums"].append({"guild_id": guild.id, "channel_id": top_chat.id, "name": top_chat.name,
+                                          "posts": len(chats), "dm": dm_summary, "deleted": deleted})
+            for chat, result in zip(chats, results):
+                summary["chats"].append({
+                    "guild_id": guild.id, "channel_id": chat.id, "name": chat.name,
+                    "parent_id": top_chat.id if chat is not top_chat else None,
+                    "status": result["status"], "pdfs": result["pdfs"], "uploaded": result["uploaded"],
+                    "dm": dm_summary if chat is top_chat else {},
+                    "deleted": deleted if chat is top_chat else False,
+                })
+
+    summary["finished_at"] = time.time()
+    summary["duration_seconds"] = round(summary["finished_at"] - started, 3)
+    summary["totals"] = {
+        "chats": len(summary["chats"]),
+        "archived": sum(1 for chat in summary["chats"] if chat["pdfs"]),
+        "up_to_date": sum(1 for chat in summary["chats"] if chat["status"] == "Up to date"),
+        "failed": sum(1 for chat in summary["chats"] if not chat["pdfs"] and chat["status"] != "Up to date"),
+        "uploaded": sum(1 for chat in summary["chats"] if chat["uploaded"]),
+        "pdfs": sum(len(chat["pdfs"]) for chat in summary["chats"]),
+        "skipped": len(summary["skipped"]),
+    }
+    return summary
+
+async def run_headless_main(job, journal=None):
+    """
+    Runs a batch job, writes its summary (stdout and/or the job's summary file) and sets the exit code.
+    A new journal is started unless one is given (when resuming).
+    """
+    global exit_code
+    try:
+        if journal is None:
+            journal = ArchiveJournal.start(os.getenv('SAVE_DIRECTORY', "."), job)
+        summary = await run_headless_job(job, journal=journal)
+    except Exception as e:
+        console.print(f"[bold red]Batch job failed: {e}[/bold red]")
+        summary = {"error": str(e)}
+        exit_code = 2
+    else:
+        exit_code = 1 if summary["totals"]["failed"] else 0
+        journal.finish(complete=not summary["totals"]["failed"])
+    write_batch_summary(job, summary)
+
+def write_batch_summary(job, summary):
+    """
+    Prints a batch job's JSON summary to stdout and writes it to the job's summary file, if any.
+    """
+    summary_json = json.dumps(summary, indent=2)
+    if job.get("summary"):
+        try:
+            with open(job["summary"], 'w', encoding='utf-8') as f:
+                f.write(summary_json)
+        except OSError as e:
+            console.print(f"[red]Could not write the summary to {job['summary']}: {e}[/red]")
+    print(summary_json)
+
+# --- Distributed Work Queue ---
+class WorkQueue:
+    """
+    A durable SQLite queue of chats to archive, shared by a coordinator and any number of worker
+    processes (on other hosts too, through a shared SAVE_DIRECTORY). Every state change is a
+    single IMMEDIATE transaction, so two workers can never lease the same chat at once.
+
+    Jobs move pending -> leased -> done, or back to pending when a lease expires or an attempt
+    fails, until QUEUE_MAX_ATTEMPTS attempts have failed. Leases use wall-clock time, so hosts'
+    clocks must roughly agree.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            chat_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            name TEXT NOT NULL,
+            priority REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_token TEXT,
+            lease_expires REAL,
+            enqueued_at REAL NOT NULL,
+            finished_at REAL,
+            seconds REAL,
+            pdfs TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        connection = self.connect()
+        try:
+            connection.executescript(self.SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self.connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def enqueue(self, jobs):
+        """
+        Adds (chat_id, guild_id, name, priority) jobs. Chats already queued are reset to pending
+        for a new run, unless a worker currently holds them. Returns the number of jobs queued.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                """
+                INSERT INTO jobs (chat_id, guild_id, name, priority, enqueued_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    name = excluded.name, priority = excluded.priority, enqueued_at = excluded.enqueued_at,
+                    status = 'pending', attempts = 0, lease_owner = NULL, lease_token = NULL, lease_expires = NULL,
+                    finished_at = NULL, seconds = NULL, pdfs = NULL, error = NULL
+                WHERE jobs.status != 'leased' OR jobs.lease_expires < ?
+                """,
+                [(*job, now, now) for job in jobs],
+            )
+            return connection.total_changes - before
+
+    def lease(self, owner, lease_seconds):
+        """
+        Leases the largest pending job (or one whose lease expired) to `owner`. Returns its row, or None.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            # Expired leases whose attempts are used up are failed rather than handed out again.
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = coalesce(error, 'lease expired'), lease_owner = NULL, lease_token = NULL "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, QUEUE_MAX_ATTEMPTS))
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY priority DESC, chat_id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            token = os.urandom(8).hex()
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_token = ?, lease_expires = ? "
+                "WHERE chat_id = ?", (owner, token, now + lease_seconds, row["chat_id"]))
+            return {**dict(row), "lease_token": token, "attempts": row["attempts"] + 1}
+
+    def renew(self, job, lease_seconds):
+        """
+        Extends a lease. Returns False if the lease was lost (it expired and another worker took the job).
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE chat_id = ? AND status = 'leased' AND lease_token = ?",
+                (time.time() + lease_seconds, job["chat_id"], job["lease_token"]))
+            return cursor.rowcount == 1
+
+    def finish(self, job, pdfs=None, error=None, seconds=None, retry=True):
+        """
+        Records the outcome of a leased job: done, back to pending for another attempt, or failed.
+        Returns False if the lease was lost in the meantime, in which case nothing is recorded.
+        """
+        if error is None:
+            status = "done"
+        else:
+            status = "pending" if retry and job["attempts"] < QUEUE_MAX_ATTEMPTS else "failed"
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_token = NULL, lease_expires = NULL, "
+                "finished_at = ?, seconds = ?, pdfs = ?, error = ? WHERE chat_id = ? AND lease_token = ?",
+                (status, time.time(), seconds, json.dumps(pdfs or []), error, job["chat_id"], job["lease_token"]))
+            return cursor.rowcount == 1
+
+    def has_active_leases(self):
+        connection = self.connect()
+        try:
+            return connection.execute("SELECT 1 FROM jobs WHERE status = 'leased' LIMIT 1").fetchone() is not None
+        finally:
+            connection.close()
+
+    def status(self):
+        """
+        Returns the job counts per status and every job's row.
+        """
+        connection = self.connect()
+        try:
+            rows = [dict(row) for row in connection.execute("SELECT * FROM jobs ORDER BY priority DESC, chat_id")]
+        finally:
+            connection.close()
+        counts = {}
+        for row in rows:
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        return counts, rows
+
+def work_queue_path(args):
+    return args.queue or os.path.join(os.getenv('SAVE_DIRECTORY', "."), ARCHIVE_QUEUE_FILE)
+
+async def run_queue_enqueue(job, queue_path):
+    """
+    Coordinator: enumerates the chats of a batch job (guilds, channels, threads) into the work queue,
+    largest estimated first. Returns an exit code.
+    """
+    selected = await resolve_job_chats(job)
+    estimator = JobEstimator(os.getenv('SAVE_DIRECTORY', "."))
+    jobs = []
+    for guild, entries in selected.items():
+        for _, chats in entries:
+            for chat in chats:
+                jobs.append((chat.id, guild.id, chat_display_name(chat), estimator.estimate(chat)[0]))
+    if not jobs:
+        console.print("[red]No readable channels matched the job; nothing was queued.[/red]")
+        return 1
+    queued = WorkQueue(queue_path).enqueue(jobs)
+    console.print(f"[green]Queued {queued} of {len(jobs)} chat(s) in {queue_path}.[/green]")
+    if queued < len(jobs):
+        console.print(f"[yellow]{len(jobs) - queued} chat(s) are being archived by a worker right now and were left alone.[/yellow]")
+    return 0
+
+async def run_queue_worker(queue_path, worker_id=None, concurrency=None, wait=False):
+    """
+    Worker: leases chats from the work queue and archives them with archive_one_channel, renewing
+    each lease while it works, until no work is left (or forever with `wait`). Returns an exit code.
+    """
+    global archive_state_lock, MEDIA_CACHE_DIR, ARCHIVE_INDEX_FILE
+    queue = WorkQueue(queue_path)
+    # Workers on other hosts update the same incremental state file; take the queue's database lock for it.
+    archive_state_lock = queue.transaction
+    if MEDIA_CACHE_DIR:
+        # Cache pins only protect this process's exports, so eviction could delete media another worker still needs.
+        console.print("[yellow]Warning: MEDIA_CACHE_DIR is not supported by queue workers and is ignored.[/yellow]")
+        MEDIA_CACHE_DIR = None
+    if ARCHIVE_INDEX_FILE:
+        # The index runs in WAL mode, which does not work for writers on different hosts of a shared file system.
+        console.print("[yellow]Warning: ARCHIVE_INDEX_FILE is not supported by queue workers and is ignored.[/yellow]")
+        ARCHIVE_INDEX_FILE = None
+    worker_id = worker_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'worker'}:{os.getpid()}"
+    concurrency = max(1, concurrency or ARCHIVE_CONCURRENCY)
+    discord_token = bot.http.token
+    dce_cli_path = os.getenv('DCE_CLI_PATH') or shutil.which("DiscordChatExporter.Cli")
+    save_directory = os.getenv('SAVE_DIRECTORY', ".")
+    loop = asyncio.get_running_loop()
+    counts = {"done": 0, "failed": 0}
+
+    async def keep_lease(job, work):
+        while not work.done():
+            await asyncio.sleep(QUEUE_LEASE_SECONDS / 3)
+            if not await loop.run_in_executor(None, queue.renew, job, QUEUE_LEASE_SECONDS):
+                console.print(f"[red]Lost the lease on {job['name']}; another worker has taken it over.[/red]")
+                work.cancel()
+                return
+
+    async def process(job):
+        console.print(f"[cyan]{worker_id}: archiving {job['name']} (attempt {job['attempts']}/{QUEUE_MAX_ATTEMPTS}).[/cyan]")
+        started = time.perf_counter()
+        chat = bot.get_channel(job["chat_id"])
+        if chat is None:
+            try:
+                chat = await bot.fetch_channel(job["chat_id"])
+            except (discord.NotFound, discord.Forbidden) as e:
+                await loop.run_in_executor(None, functools.partial(queue.finish, job, error=f"channel unavailable: {e}", retry=False))
+                counts["failed"] += 1
+                return
+            except discord.HTTPException as e:
+                await loop.run_in_executor(None, functools.partial(queue.finish, job, error=str(e)))
+                return
+
+        statuses = []
+        work = asyncio.create_task(archive_one_channel(chat, discord_token, save_directory, dce_cli_path, status_callback=statuses.append))
+        heartbeat = asyncio.create_task(keep_lease(job, work))
+        error = None
+        pdfs = []
+        try:
+            pdfs = as_pdf_list(await work)
+            if not pdfs and statuses[-1:] != ["Up to date"]:
+                error = "export or conversion failed"
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise
+            return  # The lease was lost; the new holder reports the result.
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            heartbeat.cancel()
+
+        seconds = time.perf_counter() - started
+        recorded = await loop.run_in_executor(
+            None, functools.partial(queue.finish, job, pdfs=pdfs, error=error, seconds=seconds))
+        if not recorded:
+            console.print(f"[yellow]The lease on {job['name']} expired before it finished; its result was not recorded.[/yellow]")
+        elif error:
+            counts["failed"] += 1
+            console.print(f"[red]{worker_id}: {job['name']} failed: {error}[/red]")
+        else:
+            counts["done"] += 1
+            console.print(f"[green]{worker_id}: archived {job['name']} in {seconds:.1f}s.[/green]")
+
+    async def slot():
+        while True:
+            job = await loop.run_in_executor(None, queue.lease, worker_id, QUEUE_LEASE_SECONDS)
+            if job is None:
+                # Stay while other workers hold leases: if one of them crashes, its chats come back here.
+                if wait or await loop.run_in_executor(None, queue.has_active_leases):
+                    await asyncio.sleep(QUEUE_POLL_SECONDS)
+                    continue
+                return
+            await process(job)
+
+    console.print(Rule(f"[bold cyan]Worker {worker_id} ({concurrency} slot(s)) on {queue_path}[/bold cyan]"))
+    await asyncio.gather(*(slot() for _ in range(concurrency)))
+    console.print(f"[bold]Worker finished: {counts['done']} archived, {counts['failed']} failed.[/bold]")
+    return 1 if counts["failed"] else 0
+
+def run_queue_status(queue_path, as_json=False):
+    """
+    Prints the work queue's progress. Returns an exit code.
+    """
+    if not os.path.exists(queue_path):
+        console.print(f"[red]No work queue at {queue_path}.[/red]")
+        return 2
+    counts, rows = WorkQueue(queue_path).status()
+    if as_json:
+        for row in rows:
+            row["pdfs"] = json.loads(row["pdfs"]) if row["pdfs"] else []
+            row.pop("lease_token", None)
+        print(json.dumps({"counts": counts, "jobs": rows}, indent=2))
+        return 0
+    console.print(f"[bold]{queue_path}:[/bold] " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    now = time.time()
+    for row in rows:
+        if row["status"] == "leased":
+            console.print(f"[cyan]  {row['name']}: leased by {row['lease_owner']} (expires in {format_duration(row['lease_expires'] - now)})[/cyan]")
+        elif row["status"] == "failed":
+            console.print(f"[red]  {row['name']}: failed after {row['attempts']} attempt(s): {row['error']}[/red]")
+    return 1 if counts.get("failed") else 0
+
+async def run_queue_main(command):
+    """
+    Runs the logged-in part of a `queue enqueue` or `worker` command and sets the exit code.
+    """
+    global exit_code
+    try:
+        if command["kind"] == "enqueue":
+            exit_code = await run_queue_enqueue(command["job"], command["queue"])
+        else:
+            exit_code = await run_queue_worker(command["queue"], worker_id=command["worker_id"],
+                                               concurrency=command["jobs"], wait=command["wait"])
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Work queue error: {e}[/bold red]")
+        exit_code = 2
+
 async def run_main_process():
     """
     The main process loop that presents the top-level choice.
@@ -559,6 +4006,24 @@ async def on_ready():
     When the bot is ready, it will start the main export loop.
     """
     console.print(Rule(f'[bold green]Logged in as {bot.user.name} ({bot.user.id})[/bold green]'))
+    # on_ready fires again after reconnects; only start the work once.
+    if getattr(bot, 'archiver_started', False):
+        return
+    bot.archiver_started = True
+    ready_seconds = time.perf_counter() - getattr(bot, 'start_requested_at', time.perf_counter())
+    metrics.add("startup", ready_seconds, guilds=len(bot.guilds), mode=STARTUP_MODE)
+    console.print(f"[grey]Ready in {ready_seconds:.1f}s ({len(bot.guilds)} server(s), {STARTUP_MODE} startup).[/grey]")
+
+    if headless_job is not None or queue_command is not None:
+        if queue_command is not None:
+            await run_queue_main(queue_command)
+        else:
+            await run_headless_main(headless_job, journal=resume_journal)
+        close_render_pool()
+        close_downscale_pool()
+        metrics.write_reports()
+        await bot.close()
+        return
     
     while True:
         should_continue = await run_main_process()
@@ -569,12 +4034,22 @@ async def on_ready():
         if not Confirm.ask(continue_prompt, default=True):
             break
 
+    close_render_pool()
+    close_downscale_pool()
+    metrics.write_reports()
     await bot.close()
 
 
 async def main_async():
     """Asynchronous main function to run the bot."""
+    global exit_code
     discord_token = os.getenv('DISCORD_TOKEN')
+    if not discord_token and (headless_job is not None or queue_command is not None):
+        console.print("[red]DISCORD_TOKEN must be set for batch, queue and worker commands. Exiting.[/red]")
+        exit_code = 2
+        if headless_job is not None:
+            write_batch_summary(headless_job, {"error": "DISCORD_TOKEN is not set"})
+        return
     if not discord_token:
         token_prompt = Text("Enter your Discord Bot or User Token", style=prompt_style)
         discord_token = Prompt.ask(token_prompt, password=True)
@@ -584,18 +4059,151 @@ async def main_async():
         return
 
     try:
+        bot.start_requested_at = time.perf_counter()
         await bot.start(discord_token)
     except discord.LoginFailure:
         console.print("\n[red]Error: Invalid Discord token provided.[/red]")
+        exit_code = 2
+        if headless_job is not None:
+            write_batch_summary(headless_job, {"error": "login failed"})
     finally:
         console.print(Rule("[bold green]Bot has been shut down.[/bold green]"))
 
 
+def run_search_command(args):
+    """
+    Searches the archive index from the command line and prints the matches. Returns an exit code.
+    """
+    index_path = args.index or ARCHIVE_INDEX_FILE
+    if not index_path or not os.path.exists(index_path):
+        console.print("[red]No archive index found. Set ARCHIVE_INDEX_FILE (and archive some channels) or pass --index.[/red]")
+        return 2
+    started = time.perf_counter()
+    try:
+        matches = ArchiveIndex(index_path).search(
+            args.query, guild_id=args.guild, channel_id=args.channel, author=args.author,
+            after=args.after, before=args.before, limit=args.limit)
+    except sqlite3.Error as e:
+        console.print(f"[red]Search failed: {e}[/red]")
+        return 2
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if args.json:
+        print(json.dumps(matches, indent=2, ensure_ascii=False))
+        return 0 if matches else 1
+    table = Table(show_lines=False)
+    for column in ("Time (UTC)", "Server", "Channel", "Author", "Message"):
+        table.add_column(column, overflow="fold")
+    for match in matches:
+        snippet = escape(match["snippet"] or "").replace("\x02", "[bold yellow]").replace("\x03", "[/bold yellow]")
+        table.add_row(match["timestamp"].replace("T", " ")[:19], escape(match["guild_name"] or "DM"),
+                      escape(match["channel_name"] or ""), escape(match["author_name"] or "?"), snippet)
+    if matches:
+        console.print(table)
+    console.print(f"[cyan]{len(matches)} match(es) in {elapsed_ms:.1f} ms.[/cyan]")
+    return 0 if matches else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Archive Discord channels to PDF. Runs interactively when no command is given.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Archive guilds or channels unattended from a job file and/or arguments.")
+    batch.add_argument("--job", help="JSON job file with guilds, channels, channel_filter, include_threads, upload, dm_members, delete and summary keys.")
+    batch.add_argument("--guild", type=int, action="append", help="Archive every readable text channel of this server (repeatable).")
+    batch.add_argument("--channel", type=int, action="append", help="Archive this channel or thread (repeatable).")
+    batch.add_argument("--filter", help="Only archive channels whose name matches this regular expression.")
+    batch.add_argument("--threads", dest="include_threads", action="store_true", default=None, help="Include active and archived threads (default).")
+    batch.add_argument("--no-threads", dest="include_threads", action="store_false", help="Do not include threads.")
+    batch.add_argument("--upload", dest="upload", action="store_true", default=None, help="Upload PDFs to the archive channel.")
+    batch.add_argument("--dm-members", dest="dm_members", action="store_true", default=None, help="DM the PDFs to every non-bot member of each channel.")
+    batch.add_argument("--delete", dest="delete", action="store_true", default=None, help="Delete channels given with --channel after they were archived (and uploaded, with --upload).")
+    batch.add_argument("--summary", help="Also write the JSON summary to this file.")
+
+    search = subparsers.add_parser("search", help="Search the messages of every archived channel in the archive index.")
+    search.add_argument("query", help='FTS5 query: words, "exact phrases", prefix*, AND/OR/NOT.')
+    search.add_argument("--guild", type=int, help="Only search this server.")
+    search.add_argument("--channel", type=int, help="Only search this channel or thread.")
+    search.add_argument("--author", help="Only messages whose author name contains this text.")
+    search.add_argument("--after", help="Only messages sent at or after this UTC time (ISO format, e.g. 2024-01-31).")
+    search.add_argument("--before", help="Only messages sent before this UTC time (ISO format).")
+    search.add_argument("--limit", type=int, default=20, help="Maximum number of matches (default: 20).")
+    search.add_argument("--index", help="Archive index database (default: ARCHIVE_INDEX_FILE).")
+    search.add_argument("--json", action="store_true", help="Print the matches as JSON.")
+
+    queue = subparsers.add_parser("queue", help="Manage the durable work queue for distributed archiving.")
+    queue_commands = queue.add_subparsers(dest="queue_command", required=True)
+    enqueue = queue_commands.add_parser("enqueue", help="Enumerate the channels of a job (like batch) into the work queue.")
+    enqueue.add_argument("--job", help="JSON job file with guilds, channels, channel_filter and include_threads keys.")
+    enqueue.add_argument("--guild", type=int, action="append", help="Queue every readable text channel of this server (repeatable).")
+    enqueue.add_argument("--channel", type=int, action="append", help="Queue this channel or thread (repeatable).")
+    enqueue.add_argument("--filter", help="Only queue channels whose name matches this regular expression.")
+    enqueue.add_argument("--threads", dest="include_threads", action="store_true", default=None, help="Include active and archived threads (default).")
+    enqueue.add_argument("--no-threads", dest="include_threads", action="store_false", help="Do not include threads.")
+    enqueue.set_defaults(upload=None, dm_members=None, delete=None, summary=None)
+    status = queue_commands.add_parser("status", help="Show how far the queued archive has progressed.")
+    status.add_argument("--json", action="store_true", help="Print every job as JSON.")
+    for queue_parser in (enqueue, status):
+        queue_parser.add_argument("--queue", help=f"Work queue database (default: {ARCHIVE_QUEUE_FILE} in SAVE_DIRECTORY).")
+
+    worker = subparsers.add_parser("worker", help="Lease chats from the work queue and archive them until it is empty.")
+    worker.add_argument("--queue", help=f"Work queue database (default: {ARCHIVE_QUEUE_FILE} in SAVE_DIRECTORY).")
+    worker.add_argument("--worker-id", help="Name recorded on leased jobs (default: host:pid).")
+    worker.add_argument("--jobs", type=int, help="Chats archived at the same time by this worker (default: ARCHIVE_CONCURRENCY).")
+    worker.add_argument("--wait", action="store_true", help="Keep polling for new work instead of exiting when the queue is empty.")
+
+    resume = subparsers.add_parser("resume", help="Resume an interrupted run, skipping stages its journal records as done.")
+    resume.add_argument("--journal", help="Journal file to resume (default: the latest unfinished run's journal in SAVE_DIRECTORY).")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "search":
+        sys.exit(run_search_command(args))
+    if args.command == "queue" and args.queue_command == "status":
+        sys.exit(run_queue_status(work_queue_path(args), as_json=args.json))
+    if args.command == "queue":
+        try:
+            queue_command = {"kind": "enqueue", "job": load_job_spec(args), "queue": work_queue_path(args)}
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Invalid queue job: {e}[/red]")
+            sys.exit(2)
+    elif args.command == "worker":
+        queue_command = {"kind": "worker", "queue": work_queue_path(args), "worker_id": args.worker_id,
+                         "jobs": args.jobs, "wait": args.wait}
+    elif args.command == "batch":
+        try:
+            headless_job = load_job_spec(args)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Invalid batch job: {e}[/red]")
+            sys.exit(2)
+        # Keep stdout for the machine-readable summary.
+        console.file = sys.stderr
+    elif args.command == "resume":
+        if args.journal:
+            try:
+                resume_journal = ArchiveJournal.load(args.journal)
+            except (OSError, ValueError) as e:
+                console.print(f"[red]Could not read journal {args.journal}: {e}[/red]")
+                sys.exit(2)
+            if resume_journal.data.get("status") == "complete":
+                console.print(f"[green]The run recorded in {args.journal} already completed; nothing to resume.[/green]")
+                sys.exit(0)
+        else:
+            resume_journal = ArchiveJournal.find_resumable(os.getenv('SAVE_DIRECTORY', "."))
+            if resume_journal is None:
+                console.print("[green]No unfinished run to resume.[/green]")
+                sys.exit(0)
+        console.print(f"[cyan]Resuming the run recorded in {resume_journal.path}.[/cyan]")
+        resume_journal.claim()
+        headless_job = resume_journal.data["job"]
+        console.file = sys.stderr
     try:
         asyncio.run(main_async())
     except KeyboardInterrupt:
         console.print("\n[yellow]Operation cancelled by user.[/yellow]")
+        exit_code = exit_code or 130
     except Exception as e:
         console.print(f"\n[red]An unexpected error occurred: {e}[/red]")
+        exit_code = exit_code or 1
+    sys.exit(exit_code)
 
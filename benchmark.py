@@ -0,0 +1,347 @@
+"""
+Offline benchmark for the archiver.
+
+Runs the real export -> render -> upload -> DM code paths of archive.py against synthetic
+channels, without a Discord server: a stand-in DiscordChatExporter (this script, invoked
+through a small wrapper set as the DCE path) writes HTML exports of a configurable size,
+and uploads/DMs go to fake destinations that simulate latency and bandwidth.
+
+Examples:
+    python benchmark.py --channels 4 --messages 5000 --attachments 40 --image-size 1280x720
+    python benchmark.py --mode pipeline --render-workers 4 --json results.json
+"""
+import os
+import sys
+import argparse
+import asyncio
+import json
+import random
+import re
+import shlex
+import shutil
+import stat
+import struct
+import tempfile
+import time
+import zlib
+
+# Milliseconds between the Unix epoch and the Discord epoch, for synthetic snowflakes.
+DISCORD_EPOCH_MS = 1420070400000
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua archive export render channel thread message server pdf upload").split()
+
+# --- Stand-in DiscordChatExporter ---
+def write_png(path, width, height, rng):
+    """
+    Writes a noisy RGB PNG, which compresses about as badly as a real photo or screenshot.
+    """
+    row_bytes = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 1)))
+        f.write(chunk(b"IEND", b""))
+
+def fake_dce_main(argv):
+    """
+    Accepts DiscordChatExporter's `export` arguments and writes a synthetic HTML export
+    described by the BENCHMARK_SPEC environment variable, printing progress like DCE does.
+    """
+    parser = argparse.ArgumentParser(prog="fake-dce")
+    parser.add_argument("command")
+    parser.add_argument("-t", "--token")
+    parser.add_argument("-c", "--channel", type=int, required=True)
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--after")
+    parser.add_argument("--before")
+    parser.add_argument("--media-dir")
+    parser.add_argument("--media", action="store_true")
+    parser.add_argument("--reuse-media", action="store_true")
+    parser.add_argument("--markdown", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+    spec = json.loads(os.environ["BENCHMARK_SPEC"])
+
+    rng = random.Random(args.channel)
+    base = os.path.splitext(os.path.basename(args.output))[0]
+    media_dir = args.media_dir or os.path.join(os.path.dirname(args.output), f"{base}_attachments")
+    os.makedirs(media_dir, exist_ok=True)
+    media_href = os.path.relpath(media_dir, os.path.dirname(os.path.abspath(args.output)))
+
+    messages = spec["messages"]
+    attachments = min(spec["attachments"], messages) if messages else 0
+    attachment_every = messages // attachments if attachments else 0
+    width, height = spec["image_width"], spec["image_height"]
+    start_ms = int(time.time() * 1000) - messages * 60000
+    last_percent = -1
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Benchmark</title></head><body>'
+                '<div class="chatlog">\n')
+        written_attachments = 0
+        for number in range(messages):
+            message_id = (start_ms + number * 60000 - DISCORD_EPOCH_MS) << 22
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, spec["words_per_message"])))
+            f.write(f'<div class="chatlog__message-group"><div id="chatlog__message-container-{message_id}" '
+                    f'class="chatlog__message-container" data-message-id="{message_id}"><div class="chatlog__message">'
+                    f'<div class="chatlog__header"><span class="chatlog__author">user{rng.randint(1, 50)}</span></div>'
+                    f'<div class="chatlog__content chatlog__markdown">{text}</div>')
+            if attachment_every and number % attachment_every == 0 and written_attachments < attachments:
+                name = f"{args.channel}-{written_attachments}.png"
+                write_png(os.path.join(media_dir, name), width, height, rng)
+                f.write(f'<div class="chatlog__attachment"><a href="{media_href}/{name}">'
+                        f'<img class="chatlog__attachment-media" src="{media_href}/{name}" alt="Image attachment"></a></div>')
+                written_attachments += 1
+            f.write('</div></div></div>\n')
+            percent = (number + 1) * 100 // messages
+            if percent != last_percent:
+                last_percent = percent
+                sys.stdout.write(f"\rExporting channel... {percent}%")
+                sys.stdout.flush()
+        f.write('</div></body></html>\n')
+    print(f"\nSuccessfully exported {messages} message(s).")
+    return 0
+
+def make_fake_dce(directory):
+    """
+    Writes an executable wrapper that runs this script's stand-in exporter, and returns its path.
+    """
+    path = os.path.join(directory, "fake-dce")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} fake-dce "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+# --- Fake Discord Destinations ---
+class FakeAttachment:
+    def __init__(self, url, filename, size):
+        self.url = url
+        self.filename = filename
+        self.size = size
+
+class FakeMessage:
+    def __init__(self, attachments):
+        self.attachments = attachments
+
+class FakeGuild:
+    def __init__(self, guild_id, name, filesize_limit):
+        self.id = guild_id
+        self.name = name
+        self.filesize_limit = filesize_limit
+
+class FakeDestination:
+    """
+    Something that can be sent to: consumes the uploaded files and waits as long as a
+    request of that size would take at the configured latency and bandwidth.
+    """
+
+    def __init__(self, destination_id, name, guild, latency, bandwidth):
+        self.id = destination_id
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.bot = False
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.sent_bytes = 0
+        self.sent_messages = 0
+
+    async def send(self, content=None, files=None):
+        attachments = []
+        size = len(content or "")
+        for file in files or []:
+            data = file.fp.read()
+            size += len(data)
+            attachments.append(FakeAttachment(f"https://cdn.example.invalid/{self.id}/{file.filename}", file.filename, len(data)))
+        await asyncio.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+        self.sent_bytes += size
+        self.sent_messages += 1
+        return FakeMessage(attachments)
+
+class FakeChannel:
+    def __init__(self, channel_id, name, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+
+# --- Measurements ---
+def count_pdf_pages(path):
+    """
+    Counts the pages of a PDF, with pypdf when it is installed and a byte scan otherwise.
+    """
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(path).pages)
+    except ImportError:
+        with open(path, 'rb') as f:
+            return len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", f.read()))
+
+def self_peak_rss():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        return None
+
+async def run_benchmark(args, archive):
+    save_directory = tempfile.mkdtemp(prefix="archiver-bench-", dir=args.work_dir)
+    dce_cli_path = make_fake_dce(save_directory)
+    os.environ["BENCHMARK_SPEC"] = json.dumps({
+        "messages": args.messages, "attachments": args.attachments, "words_per_message": args.words_per_message,
+        "image_width": args.image_width, "image_height": args.image_height,
+    })
+    archive.metrics = archive.Metrics()
+
+    guild = FakeGuild(1, "Benchmark Server", args.upload_limit_mb * 1024 * 1024)
+    chats = [FakeChannel(1000 + number, f"bench-{number + 1}", guild) for number in range(args.channels)]
+    upload_channel = FakeDestination(2, "channel-archive", guild, args.latency, args.bandwidth_mbps * 1024 * 1024 / 8)
+    members = [FakeDestination(3000 + number, f"member{number + 1}", None, args.latency, args.bandwidth_mbps * 1024 * 1024 / 8)
+               for number in range(args.dm_members)]
+
+    started = time.perf_counter()
+    already_uploaded = []
+    if args.mode == "pipeline":
+        chat_results = await archive.run_archive_pipeline(
+            chats, "benchmark-token", save_directory, dce_cli_path, upload_channel=upload_channel if args.upload else None)
+        pdfs, already_uploaded = archive.pipeline_pdf_files(chat_results)
+    else:
+        pdfs = []
+        for chat in chats:
+            pdfs.extend(archive.as_pdf_list(await archive.archive_one_channel(chat, "benchmark-token", save_directory, dce_cli_path)))
+    archived = time.perf_counter()
+
+    # The non-interactive part of run_standard_post_archive_flow: upload, then DM fan-out.
+    to_upload = [pdf for pdf in pdfs if pdf not in already_uploaded] if args.upload else []
+    if to_upload:
+        await archive.upload_pdfs(upload_channel, to_upload)
+    if members and pdfs:
+        await archive.fan_out_dms(members, pdfs, "Benchmark archive")
+    finished = time.perf_counter()
+
+    totals = archive.metrics.totals()
+    pages = sum(count_pdf_pages(pdf) for pdf in pdfs)
+    sent_bytes = upload_channel.sent_bytes + sum(member.sent_bytes for member in members)
+    send_seconds = totals.get("send", {}).get("seconds", 0)
+    archive_seconds = archived - started
+    results = {
+        "mode": args.mode,
+        "channels": args.channels,
+        "pdfs": len(pdfs),
+        "messages": totals.get("export", {}).get("messages", 0),
+        "pages": pages,
+        "archive_seconds": round(archive_seconds, 3),
+        "post_archive_seconds": round(finished - archived, 3),
+        "messages_per_second": round(totals.get("export", {}).get("messages", 0) / archive_seconds, 1) if archive_seconds else None,
+        "pages_per_second": round(pages / archive_seconds, 2) if archive_seconds else None,
+        "pdf_bytes": sum(os.path.getsize(pdf) for pdf in pdfs),
+        "uploaded_bytes": sent_bytes,
+        "upload_mb_per_second": round(sent_bytes / 1024 / 1024 / send_seconds, 2) if sent_bytes and send_seconds else None,
+        "peak_rss_bytes": self_peak_rss(),
+        "peak_child_rss_bytes": max((stage.get("peak_rss_bytes") or 0 for stage in totals.values()), default=0),
+        "stages": totals,
+    }
+    if not args.keep:
+        shutil.rmtree(save_directory, ignore_errors=True)
+    else:
+        results["save_directory"] = save_directory
+    return results
+
+def print_results(results, console):
+    from rich.table import Table
+    table = Table(title=f"Benchmark ({results['mode']}, {results['channels']} channel(s))")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    rows = [
+        ("Messages exported", f"{results['messages']:,}"),
+        ("PDF pages", f"{results['pages']:,}"),
+        ("Archive time", f"{results['archive_seconds']:.2f}s"),
+        ("Messages/sec", f"{results['messages_per_second'] or 0:,.1f}"),
+        ("PDF pages/sec", f"{results['pages_per_second'] or 0:,.2f}"),
+        ("PDF size", f"{results['pdf_bytes'] / 1024 / 1024:.2f} MB"),
+        ("Upload + DM time", f"{results['post_archive_seconds']:.2f}s"),
+        ("Upload throughput (per request)", f"{results['upload_mb_per_second'] or 0:.2f} MB/s"),
+        ("Peak RSS (this process)", f"{(results['peak_rss_bytes'] or 0) / 1024 / 1024:.0f} MB"),
+        ("Peak RSS (children)", f"{(results['peak_child_rss_bytes'] or 0) / 1024 / 1024:.0f} MB"),
+    ]
+    if "downscale" in results["stages"]:
+        rows.append(("Media bytes saved by downscaling", f"{results['stages']['downscale']['bytes'] / 1024 / 1024:.2f} MB"))
+    for stage, stage_totals in results["stages"].items():
+        rows.append((f"{stage} stage", f"{stage_totals['runs']} run(s), {stage_totals['seconds']:.2f}s, {stage_totals['failures']} failed"))
+    for name, value in rows:
+        table.add_row(name, value)
+    console.print(table)
+
+def parse_size(value):
+    match = re.fullmatch(r"(\d+)x(\d+)", value)
+    if not match:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, e.g. 1280x720")
+    return int(match.group(1)), int(match.group(2))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark archiving throughput offline with synthetic channels.")
+    parser.add_argument("--mode", choices=("sequential", "pipeline"), default="sequential",
+                        help="Archive channels one by one with archive_one_channel, or with the concurrent pipeline.")
+    parser.add_argument("--channels", type=int, default=2, help="Number of synthetic channels.")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per channel.")
+    parser.add_argument("--words-per-message", type=int, default=30, help="Maximum words per message.")
+    parser.add_argument("--attachments", type=int, default=10, help="Image attachments per channel.")
+    parser.add_argument("--image-size", type=parse_size, default=(1280, 720), help="Attachment size as WIDTHxHEIGHT.")
+    parser.add_argument("--export-workers", type=int, help="Override EXPORT_WORKERS / PARTITION_WORKERS.")
+    parser.add_argument("--render-workers", type=int, help="Override RENDER_WORKERS.")
+    parser.add_argument("--upload-workers", type=int, help="Override UPLOAD_WORKERS.")
+    parser.add_argument("--render-backend", choices=("auto", "pool", "cli"), help="Override RENDER_BACKEND.")
+    parser.add_argument("--downscale-dpi", type=float, help="Override MEDIA_DOWNSCALE_DPI, to compare render times with and without downscaling.")
+    parser.add_argument("--no-upload", dest="upload", action="store_false", help="Skip uploading to the fake archive channel.")
+    parser.add_argument("--dm-members", type=int, default=3, help="Number of fake members the PDFs are DMed to.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per Discord request.")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100, help="Simulated upload bandwidth in Mbit/s (0 for unlimited).")
+    parser.add_argument("--upload-limit-mb", type=int, default=25, help="Simulated server upload limit in MB.")
+    parser.add_argument("--work-dir", help="Directory for the temporary exports (default: the system temp directory).")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated exports and PDFs.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    args.image_width, args.image_height = args.image_size
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    import archive
+
+    # Keep the run reproducible regardless of the local .env.
+    archive.INCREMENTAL_MODE = "off"
+    archive.EXPORTER = "dce"
+    archive.PARTITION_DAYS = 0
+    archive.MEDIA_CACHE_DIR = None
+    archive.METRICS_FILE = archive.METRICS_PROM_FILE = None
+    archive.ARCHIVE_INDEX_FILE = None
+    archive._archive_index = None
+    archive.COMMAND_LOG_DIR = None
+    if args.export_workers:
+        archive.EXPORT_WORKERS = archive.PARTITION_WORKERS = args.export_workers
+    if args.render_workers:
+        archive.RENDER_WORKERS = args.render_workers
+    if args.upload_workers:
+        archive.UPLOAD_WORKERS = args.upload_workers
+    if args.render_backend:
+        archive.RENDER_BACKEND = args.render_backend
+    if args.downscale_dpi is not None:
+        archive.MEDIA_DOWNSCALE_DPI = args.downscale_dpi
+
+    try:
+        results = asyncio.run(run_benchmark(args, archive))
+    finally:
+        archive.close_render_pool()
+        archive.close_downscale_pool()
+    print_results(results, archive.console)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0 if results["pdfs"] == args.channels else 1
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "fake-dce":
+        sys.exit(fake_dce_main(sys.argv[2:]))
+    sys.exit(main())